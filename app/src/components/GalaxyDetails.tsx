@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useState } from 'react';
 import { Loader2, Telescope } from 'lucide-react';
 
 interface GalaxyDetailsProps {
@@ -20,6 +20,14 @@ interface GalaxyDetailsProps {
 }
 
 const GalaxyDetails: React.FC<GalaxyDetailsProps> = ({ galaxy, cutoutImages, isLoading, isCutoutsLoading }) => {
+  // Cutout URLs whose image failed to load (a DAS or render error answers the image request itself)
+  const [failedUrls, setFailedUrls] = useState<Set<string>>(new Set());
+
+  const handleImageError = (url: string) => {
+    console.error(`GalaxyDetails: Action=Cutout failed to load, url=${url}`);
+    setFailedUrls((previous) => new Set(previous).add(url));
+  };
+
   return (
     <div className="space-y-8">
       {/* Header Info */}
@@ -82,14 +90,14 @@ const GalaxyDetails: React.FC<GalaxyDetailsProps> = ({ galaxy, cutoutImages, isL
                       <div className="w-1.5 h-1.5 rounded-full bg-blue-500 animate-pulse" />
                     </div>
                     <div className="aspect-square relative bg-black">
-                      {img.url ? (
+                      {img.url && !failedUrls.has(img.url) ? (
                         <>
-                          <img src={img.url} alt={img.filter} className="w-full h-full object-cover grayscale contrast-125 group-hover:scale-110 transition-transform duration-500" />
+                          <img src={img.url} alt={img.filter} onError={() => handleImageError(img.url)} className="w-full h-full object-cover grayscale contrast-125 group-hover:scale-110 transition-transform duration-500" />
                           <div className="absolute inset-0 bg-blue-500/5 mix-blend-overlay" />
                         </>
                       ) : (
                         <div className="w-full h-full flex items-center justify-center p-4 text-center">
-                          <span className="mono text-[8px] text-red-500/50 uppercase font-bold">{img.error || 'Sensor_Failure'}</span>
+                          <span className="mono text-[8px] text-red-500/50 uppercase font-bold">{img.error || (failedUrls.has(img.url) ? 'Failed to load cutout' : 'Sensor_Failure')}</span>
                         </div>
                       )}
                     </div>
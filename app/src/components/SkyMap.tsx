@@ -36,6 +36,30 @@ interface SkyMapProps {
   onGalaxySelect: (details: GalaxyDetails | null, isLoading: boolean) => void;
 }
 
+// Stable per-tab id sent with searches, so the backend can replace this tab's cutout prefetch
+// when it searches again (sessionStorage is per tab and survives reloads)
+const CLIENT_ID_KEY = 'hscClientId';
+const getClientId = (): string => {
+  let clientId: string | null = null;
+  try {
+    clientId = sessionStorage.getItem(CLIENT_ID_KEY);
+  } catch {
+    // Storage can be blocked; an id for this page load still keeps the tab's searches together
+  }
+  if (!clientId) {
+    // randomUUID only exists in secure contexts, so plain-http deployments get a random string instead
+    clientId = typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function'
+      ? crypto.randomUUID()
+      : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    try {
+      sessionStorage.setItem(CLIENT_ID_KEY, clientId);
+    } catch {
+      // See above
+    }
+  }
+  return clientId;
+};
+
 const SkyMap: React.FC<SkyMapProps> = ({ width, height, onGalaxySelect }) => {
   const iframeRef = useRef<HTMLIFrameElement>(null);
   const [windowId, setWindowId] = useState<string | null>(null);
@@ -46,11 +70,22 @@ const SkyMap: React.FC<SkyMapProps> = ({ width, height, onGalaxySelect }) => {
   const [error, setError] = useState<string | null>(null);
   const [raDecInput, setRaDecInput] = useState<string>('');
   const [isLoading, setIsLoading] = useState(false);
+  const [clientId] = useState<string>(getClientId);
 
   // Use relative paths to leverage Vite proxy and avoid mixed content errors in production
   const apiBaseUrl = "";
   console.log(`SkyMap: apiBaseUrl="${apiBaseUrl}" (forced to relative)`);
 
+  // POST a query; if the backend answers 202 with a job handle, long-poll the job until its result is ready
+  const postHscQuery = async (url: string, body: object) => {
+    let response = await axios.post(url, body);
+    while (response.status === 202) {
+      console.log(`postHscQuery: Action=Job still running, job_id=${response.data.job_id}`);
+      response = await axios.get(`${apiBaseUrl}${response.data.result_url}`, { params: { wait: 30 } });
+    }
+    return response;
+  };
+
   // Parse RA and Dec from input string like "α=75.194502° δ=-33.193044°"
   const parseRaDec = (input: string): { ra: number; dec: number } | null => {
     console.log(`parseRaDec: Action=Parsing input, input="${input}"`);
@@ -82,10 +117,11 @@ const SkyMap: React.FC<SkyMapProps> = ({ width, height, onGalaxySelect }) => {
     try {
       const url = `${apiBaseUrl}/api/queryGalaxies`;
       console.log(`queryHscDatabase: Requesting URL="${url}"`);
-      const response = await axios.post(url, {
+      const response = await postHscQuery(url, {
         ra,
         dec,
         radius: 10 / 3600, // 10 arcseconds
+        client_id: clientId,
       });
       const galaxies = response.data.galaxies || [];
       // Sort by object_id
@@ -112,7 +148,7 @@ const SkyMap: React.FC<SkyMapProps> = ({ width, height, onGalaxySelect }) => {
     try {
       const url = `${apiBaseUrl}/api/queryGalaxyDetails`;
       console.log(`queryGalaxyDetails: Requesting URL="${url}"`);
-      const response = await axios.post(url, { object_id: objectId });
+      const response = await postHscQuery(url, { object_id: objectId });
       const details = response.data.details;
       onGalaxySelect({ ...details, ra, dec }, false); // Include RA and Dec
       console.log(`queryGalaxyDetails: Action=Received details`, details);
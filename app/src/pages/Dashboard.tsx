@@ -30,9 +30,8 @@ const Dashboard: React.FC = () => {
                     bands,
                 });
                 const cutouts: CutoutImage[] = response.data.cutouts.map((cutout: any) => ({
-                    url: cutout.image || '',
+                    url: cutout.url || '',
                     filter: cutout.filter,
-                    error: cutout.error,
                 }));
                 setCutoutImages(cutouts);
             } catch (error) {
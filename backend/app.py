@@ -1,28 +1,31 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context, url_for
 from flask_cors import CORS
 import requests
 import json
-import urllib.request
-import urllib.error
-import urllib.parse
-import time
 import os
-import csv
-from io import StringIO
 from dotenv import load_dotenv
 from hscmap.window import Window
 from hscmap.config import config
+from hsc_client import HSCClient
+from outbound import PRIORITY_CLASSES, OutboundGovernor
+from cutout_cache import CutoutCache, cutout_key
+from cutout_prefetch import CutoutPrefetcher
+from cutout_render import FORMATS, RENDER_VERSION, STRETCHES, render_composite, render_cutout
+from hsc_csv import HSCCSVError, read_hsc_csv
+from hsc_jobs import HSCJobManager
+from query_cache import QueryCache
+from catalog_mirror import CatalogMirror
+from hsc_coalescer import LookupCoalescer
+from photoz import BANDS, PhotoZModel, comoving_distance
 import uuid
 import numpy as np
 import io
 import astropy.io.fits as afits
 import base64
-from io import BytesIO
 from urllib.parse import urlencode
 import requests
-import matplotlib.pyplot as plt
-from astropy.io import fits
 import numpy as np
+import concurrent.futures
 # Load environment variables from .env file
 load_dotenv()
 
@@ -35,26 +38,75 @@ windows = {}
 HSC_API_URL = 'https://hsc-release.mtk.nao.ac.jp/datasearch/api/catalog_jobs/'
 HSC_RELEASE_VERSION = 'pdr3'
 
+# Query requests answer 202 with a job handle right away; HSC_JOB_WAIT (or a client's 'wait') opts in to
+# long-polling for that many seconds first, which holds the request thread while the job runs
+HSC_JOB_WAIT = float(os.getenv('HSC_JOB_WAIT', '0'))
+HSC_JOB_MAX_WAIT = float(os.getenv('HSC_JOB_MAX_WAIT', '60'))
+# Cap on status calls per second across all outstanding jobs
+HSC_STATUS_RATE = float(os.getenv('HSC_STATUS_RATE', '5'))
+# Consecutive failed status calls after which a job is given up as failed
+HSC_STATUS_MAX_FAILURES = int(os.getenv('HSC_STATUS_MAX_FAILURES', '5'))
+
+# On-disk cache of finished query results (PDR3 is frozen, so entries never go stale); 0 disables it
+HSC_QUERY_CACHE_DIR = os.getenv('HSC_QUERY_CACHE_DIR', 'query_cache')
+HSC_QUERY_CACHE_BYTES = int(os.getenv('HSC_QUERY_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+# Local HEALPix-partitioned mirror of pdr3_wide.forced used for cone searches; off unless HSC_MIRROR=1.
+# Cones wider than HSC_MIRROR_MAX_RADIUS degrees always go to HSC, since filling them would pull too many rows.
+# A fill query returns at most HSC_MIRROR_FILL_MAX_ROWS rows; a fill that hits the cap answers its cone but is not stored.
+HSC_MIRROR = os.getenv('HSC_MIRROR', '0') == '1'
+HSC_MIRROR_DIR = os.getenv('HSC_MIRROR_DIR', 'catalog_mirror')
+HSC_MIRROR_NSIDE = int(os.getenv('HSC_MIRROR_NSIDE', '1024'))
+HSC_MIRROR_MAX_RADIUS = float(os.getenv('HSC_MIRROR_MAX_RADIUS', '0.05'))
+HSC_MIRROR_FILL_MAX_ROWS = int(os.getenv('HSC_MIRROR_FILL_MAX_ROWS', '100000'))
+
+# Photo-z network scored in-process by /api/queryGalaxiesPhotoz
+PHOTOZ_MODEL_PATH = os.getenv('PHOTOZ_MODEL_PATH', 'main_network.onnx')
+
+# queryGalaxyDetails lookups arriving within this window are merged into one IN-list job of at most this many ids
+HSC_DETAILS_WINDOW_MS = float(os.getenv('HSC_DETAILS_WINDOW_MS', '50'))
+HSC_DETAILS_MAX_IDS = int(os.getenv('HSC_DETAILS_MAX_IDS', '500'))
+
 # HSC credentials from .env
 HSC_USER = os.getenv('HSC_USER')
 HSC_PASSWORD = os.getenv('HSC_PASSWORD')
 
-def http_json_post(url, data):
-    """Helper function to send JSON POST requests to HSC API."""
-    data['clientVersion'] = 20190514.1
-    post_data = json.dumps(data).encode('utf-8')
-    headers = {'Content-type': 'application/json'}
-    req = urllib.request.Request(url, post_data, headers)
-    try:
-        with urllib.request.urlopen(req) as res:
-            return json.load(res)
-    except urllib.error.HTTPError as e:
-        raise Exception(f"HTTP Error {e.code}: {e.read().decode()}")
+# Outbound limits per archive endpoint: calls in flight and calls per second (0 = no rate cap)
+HSC_API_CONCURRENCY = int(os.getenv('HSC_API_CONCURRENCY', '8'))
+HSC_API_RATE = float(os.getenv('HSC_API_RATE', '10'))
+DAS_CUTOUT_CONCURRENCY = int(os.getenv('DAS_CUTOUT_CONCURRENCY', '8'))
+DAS_CUTOUT_RATE = float(os.getenv('DAS_CUTOUT_RATE', '20'))
+# Threads shared by all cutout requests (replaces one thread per band per request)
+CUTOUT_WORKERS = int(os.getenv('CUTOUT_WORKERS', '16'))
+# Default rendering of cutouts: stretch, longer side in pixels and image format (a request may override each)
+CUTOUT_STRETCH = os.getenv('CUTOUT_STRETCH', 'linear')
+CUTOUT_SIZE = int(os.getenv('CUTOUT_SIZE', '320'))
+CUTOUT_FORMAT = os.getenv('CUTOUT_FORMAT', 'jpeg')
+# Bands of a colour composite when a request asks for one without naming them, red channel first
+CUTOUT_COMPOSITE_BANDS = os.getenv('CUTOUT_COMPOSITE_BANDS', 'HSC-I,HSC-R,HSC-G').split(',')
+# Most positions one gallery request may ask for
+CUTOUT_GALLERY_MAX_POSITIONS = int(os.getenv('CUTOUT_GALLERY_MAX_POSITIONS', '200'))
+# Threads shared by all gallery requests, kept apart from CUTOUT_WORKERS so a gallery never queues ahead of a single cutout
+CUTOUT_GALLERY_WORKERS = int(os.getenv('CUTOUT_GALLERY_WORKERS', '4'))
+# Opt-in: after a cone search, warm the cutout cache for this many of the brightest galaxies (0 disables)
+CUTOUT_PREFETCH_COUNT = int(os.getenv('CUTOUT_PREFETCH_COUNT', '0'))
+CUTOUT_PREFETCH_BANDS = os.getenv('CUTOUT_PREFETCH_BANDS', 'HSC-G,HSC-R,HSC-I,HSC-Z,HSC-Y').split(',')
+# Threads and queued fetches allowed to prefetching, across all clients
+CUTOUT_PREFETCH_WORKERS = int(os.getenv('CUTOUT_PREFETCH_WORKERS', '2'))
+CUTOUT_PREFETCH_MAX_PENDING = int(os.getenv('CUTOUT_PREFETCH_MAX_PENDING', '200'))
+
+# Every call to the archive takes a slot here; interactive requests are admitted before background ones
+governor = OutboundGovernor({
+    'hsc_api': (HSC_API_CONCURRENCY, HSC_API_RATE),
+    'das_cutout': (DAS_CUTOUT_CONCURRENCY, DAS_CUTOUT_RATE),
+})
+
+# Shared keep-alive client for every HSC catalog job call
+hsc_client = HSCClient(base_url=HSC_API_URL, governor=governor)
 
 def submit_job(credential, sql, out_format='csv'):
     """Submit a job to the HSC API."""
     print(f"submit_job: Action=Submitting job with user={credential['account_name']}")
-    url = f"{HSC_API_URL}submit"
     catalog_job = {
         'sql': sql,
         'out_format': out_format,
@@ -62,37 +114,47 @@ def submit_job(credential, sql, out_format='csv'):
         'release_version': HSC_RELEASE_VERSION,
     }
     post_data = {'credential': credential, 'catalog_job': catalog_job, 'nomail': True, 'skip_syntax_check': False}
-    return http_json_post(url, post_data)
+    # Never resend a submit that may have reached the server, or the job would run twice
+    return hsc_client.post_json('submit', post_data, idempotent=False)
 
 def job_status(credential, job_id):
     """Check the status of an HSC API job."""
     print(f"job_status: Action=Checking status for job_id={job_id}")
-    url = f"{HSC_API_URL}status"
     post_data = {'credential': credential, 'id': job_id}
-    return http_json_post(url, post_data)
+    return hsc_client.post_json('status', post_data)
 
 def download_job(credential, job_id):
-    """Download the results of an HSC API job."""
+    """Open the results of an HSC API job as a buffered binary stream; the caller closes it."""
     print(f"download_job: Action=Downloading results for job_id={job_id}")
-    url = f"{HSC_API_URL}download"
     post_data = {'credential': credential, 'id': job_id}
-    req = urllib.request.Request(url, json.dumps(post_data).encode('utf-8'), {'Content-type': 'application/json'})
-    with urllib.request.urlopen(req) as res:
-        return res.read().decode('utf-8').strip()
-
-def block_until_job_finishes(credential, job_id):
-    """Poll until the HSC API job completes."""
-    print(f"block_until_job_finishes: Action=Polling job_id={job_id}")
-    max_interval = 300  # 5 minutes
-    interval = 1
-    while True:
-        time.sleep(interval)
-        job = job_status(credential, job_id)
-        if job['status'] == 'error':
-            raise Exception(f"Query error: {job.get('error', 'Unknown error')}")
-        if job['status'] == 'done':
-            return
-        interval = min(interval * 2, max_interval)
+    # The stream holds its hsc_api slot until the job manager closes it after parsing
+    return hsc_client.post('download', post_data, stream=True)
+
+photoz_model = PhotoZModel(PHOTOZ_MODEL_PATH)
+
+catalog_mirror = (
+    CatalogMirror(HSC_MIRROR_DIR, nside=HSC_MIRROR_NSIDE, fill_max_rows=HSC_MIRROR_FILL_MAX_ROWS)
+    if HSC_MIRROR and HSC_MIRROR_NSIDE > 0 else None
+)
+
+query_cache = QueryCache(HSC_QUERY_CACHE_DIR, HSC_QUERY_CACHE_BYTES, HSC_RELEASE_VERSION) if HSC_QUERY_CACHE_BYTES > 0 else None
+
+# Background scheduler that polls every outstanding HSC job adaptively; request threads only wait on its events
+hsc_jobs = HSCJobManager(submit_job, job_status, download_job, status_rate=HSC_STATUS_RATE, cache=query_cache,
+                         max_poll_failures=HSC_STATUS_MAX_FAILURES)
+
+@app.route('/api/metrics')
+def metrics():
+    return jsonify({
+        'hsc_api': hsc_client.stats(),
+        'outbound': governor.stats(),
+        'hsc_jobs': hsc_jobs.stats(),
+        'hsc_query_cache': query_cache.stats() if query_cache else None,
+        'catalog_mirror': catalog_mirror.stats() if catalog_mirror else None,
+        'details_coalescer': details_coalescer.stats(),
+        'cutout_cache': cutout_cache.stats() if cutout_cache else None,
+        'cutout_prefetch': cutout_prefetcher.stats() if cutout_prefetcher else None,
+    })
 
 @app.route('/hscmap/<path:path>')
 def proxy_hscmap(path):
@@ -191,6 +253,224 @@ def handle_callback(window_id, cbid):
     window._callback.call(cbid, args)
     return jsonify({'status': 'success'})
 
+# Typed columns read from each query's download
+GALAXY_COLUMNS = {'object_id': 'int64', 'ra': 'float64', 'dec': 'float64', 'r_cmodel_mag': 'float64'}
+DETAILS_COLUMNS = {
+    'object_id': 'int64', 'ra': 'float64', 'dec': 'float64', 'g_cmodel_mag': 'float64',
+    'r_cmodel_mag': 'float64', 'i_cmodel_mag': 'float64', 'z_cmodel_mag': 'float64', 'y_cmodel_mag': 'float64',
+}
+
+def galaxies_sql(ra, dec, radius):
+    """SQL for primary galaxies brighter than r=24 within ``radius`` degrees."""
+    return f"""
+    SELECT object_id, ra, dec, r_cmodel_mag
+    FROM pdr3_wide.forced
+    WHERE coneSearch(coord, {ra}, {dec}, {radius * 3600})
+    AND isprimary
+    AND r_cmodel_mag < 24
+    LIMIT 100
+    """
+
+def parse_galaxies_csv(result_csv):
+    """Parse a queryGalaxies download into (response payload, HTTP status)."""
+    try:
+        table = read_hsc_csv(result_csv, GALAXY_COLUMNS)
+    except HSCCSVError as e:
+        print(f"query_galaxies: Error: {str(e)}")
+        return {'galaxies': [], 'warning': str(e)}, 200
+
+    # Rows without a position cannot be plotted
+    table = table.dropna(subset=['ra', 'dec'])
+    if table.empty:
+        print("query_galaxies: Error: No data rows after header")
+        return {'galaxies': [], 'warning': 'No data rows found'}, 200
+
+    galaxies = [
+        {
+            'id': str(object_id),
+            'ra': ra,
+            'dec': dec,
+            'magnitude': magnitude,
+            'distance': 0.0  # Placeholder
+        }
+        for object_id, ra, dec, magnitude in zip(
+            table['object_id'].tolist(),
+            table['ra'].tolist(),
+            table['dec'].tolist(),
+            table['r_cmodel_mag'].fillna(0.0).tolist(),
+        )
+    ]
+    print(f"query_galaxies: Parsed {len(galaxies)} galaxies")
+    return {'galaxies': galaxies}, 200
+
+def galaxies_photoz_sql(ra, dec, radius):
+    """Cone search as in :func:`galaxies_sql`, also selecting the five bands the photo-z network needs."""
+    return f"""
+    SELECT object_id, ra, dec, g_cmodel_mag, r_cmodel_mag, i_cmodel_mag, z_cmodel_mag, y_cmodel_mag
+    FROM pdr3_wide.forced
+    WHERE coneSearch(coord, {ra}, {dec}, {radius * 3600})
+    AND isprimary
+    AND r_cmodel_mag < 24
+    LIMIT 100
+    """
+
+def parse_photoz_csv(result_csv):
+    """Parse a queryGalaxiesPhotoz download into columns; redshifts are added per response by :func:`score_photoz`.
+
+    Only catalog values are returned (and cached), so a new model never serves redshifts from an old one.
+    """
+    try:
+        table = read_hsc_csv(result_csv, DETAILS_COLUMNS)
+    except HSCCSVError as e:
+        print(f"query_galaxies_photoz: Error: {str(e)}")
+        return {'galaxies': [], 'warning': str(e)}, 200
+
+    table = table.dropna(subset=['ra', 'dec'])
+    if table.empty:
+        print("query_galaxies_photoz: Error: No data rows after header")
+        return {'galaxies': [], 'warning': 'No data rows found'}, 200
+
+    print(f"query_galaxies_photoz: Parsed {len(table)} galaxies")
+    return {'columns': {name: table[name].tolist() for name in DETAILS_COLUMNS}}, 200
+
+def score_photoz(payload):
+    """Turn parsed columns into galaxies with redshift and comoving distance, scoring all rows in one batch."""
+    if 'columns' not in payload:
+        return payload
+    columns = payload['columns']
+    magnitudes = np.column_stack([np.asarray(columns[band], dtype=np.float64) for band in BANDS])
+    # Rows missing any band cannot be scored and keep a null redshift
+    scorable = np.isfinite(magnitudes).all(axis=1)
+    redshift = np.full(len(magnitudes), np.nan)
+    redshift[scorable] = photoz_model.predict(magnitudes[scorable])
+    distance = comoving_distance(redshift)
+
+    def value(x):
+        return float(x) if np.isfinite(x) else None
+
+    galaxies = [
+        {
+            'id': str(columns['object_id'][i]),
+            'ra': columns['ra'][i],
+            'dec': columns['dec'][i],
+            'magnitude': value(magnitudes[i, 1]) or 0.0,
+            'g_mag': value(magnitudes[i, 0]),
+            'r_mag': value(magnitudes[i, 1]),
+            'i_mag': value(magnitudes[i, 2]),
+            'z_mag': value(magnitudes[i, 3]),
+            'y_mag': value(magnitudes[i, 4]),
+            'redshift': value(redshift[i]),
+            'distance': value(distance[i]),  # Comoving distance in Mpc (Planck18)
+        }
+        for i in range(len(magnitudes))
+    ]
+    print(f"query_galaxies_photoz: Scored {int(scorable.sum())} of {len(galaxies)} galaxies")
+    return {'galaxies': galaxies, 'distance_unit': 'Mpc'}
+
+# Per-kind step applied to a finished job's cached payload when it is returned
+RESULT_TRANSFORMS = {'queryGalaxiesPhotoz': score_photoz}
+
+def fill_mirror(ra, dec, radius, result_csv):
+    """Write a mirror fill download back to local pixels and answer the cone from its rows."""
+    galaxies = catalog_mirror.write_back(ra, dec, radius, result_csv)
+    print(f"query_galaxies: Parsed {len(galaxies)} galaxies from mirror fill")
+    return {'galaxies': galaxies}, 200
+
+def galaxy_details_sql(object_id):
+    """SQL for the five-band cmodel magnitudes of one object."""
+    return f"""
+    SELECT object_id, ra, dec, g_cmodel_mag, r_cmodel_mag, i_cmodel_mag, z_cmodel_mag, y_cmodel_mag
+    FROM pdr3_wide.forced
+    WHERE object_id = {object_id}
+    AND isprimary
+    LIMIT 1
+    """
+
+def galaxy_details_batch_sql(object_ids):
+    """SQL for the five-band cmodel magnitudes of many objects in one job."""
+    return f"""
+    SELECT object_id, ra, dec, g_cmodel_mag, r_cmodel_mag, i_cmodel_mag, z_cmodel_mag, y_cmodel_mag
+    FROM pdr3_wide.forced
+    WHERE object_id IN ({', '.join(object_ids)})
+    AND isprimary
+    """
+
+def parse_galaxy_details_rows(result_csv):
+    """Parse a queryGalaxyDetails download into (list of details, warning or None)."""
+    try:
+        table = read_hsc_csv(result_csv, DETAILS_COLUMNS)
+    except HSCCSVError as e:
+        print(f"query_galaxy_details: Error: {str(e)}")
+        return [], str(e)
+
+    if table.empty:
+        print("query_galaxy_details: Error: No data rows after header")
+        return [], 'No data rows found'
+
+    # Missing magnitudes are NaN in the table and null in the response
+    table = table.astype(object).where(table.notna(), None)
+    rows = [
+        {
+            'object_id': str(row.object_id),
+            'ra': row.ra,
+            'dec': row.dec,
+            'g_mag': row.g_cmodel_mag,
+            'r_mag': row.r_cmodel_mag,
+            'i_mag': row.i_cmodel_mag,
+            'z_mag': row.z_cmodel_mag,
+            'y_mag': row.y_cmodel_mag,
+            'redshift': None,  # Placeholder (add redshift query if available)
+            'morphology': None,  # Placeholder (add morphology query if available)
+        }
+        for row in table.itertuples(index=False)
+    ]
+    print(f"query_galaxy_details: Parsed details for {len(rows)} objects")
+    return rows, None
+
+def split_galaxy_details_csv(result_csv, object_ids):
+    """Split a batched details download into one (response payload, HTTP status) per object_id."""
+    rows, warning = parse_galaxy_details_rows(result_csv)
+    if warning:
+        return {object_id: ({'details': {}, 'warning': warning}, 200) for object_id in object_ids}
+    by_id = {row['object_id']: row for row in rows}
+    return {
+        object_id: ({'details': by_id[object_id]}, 200) if object_id in by_id
+        else ({'details': {}, 'warning': 'No data rows found'}, 200)
+        for object_id in object_ids
+    }
+
+details_coalescer = LookupCoalescer(hsc_jobs, galaxy_details_batch_sql, galaxy_details_sql, split_galaxy_details_csv,
+                                    kind='queryGalaxyDetails', window=HSC_DETAILS_WINDOW_MS / 1000,
+                                    max_keys=HSC_DETAILS_MAX_IDS)
+
+def job_response(job, wait):
+    """Long-poll ``job`` for up to ``wait`` seconds; return its result, or a 202 handle if still running."""
+    try:
+        wait = min(max(float(wait), 0.0), HSC_JOB_MAX_WAIT)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    hsc_jobs.wait(job, wait)
+    if job.status == 'error':
+        return jsonify({'error': job.error, 'job_id': job.id}), 500
+    if job.status == 'done':
+        payload, status_code = job.result
+        transform = RESULT_TRANSFORMS.get(job.kind)
+        if transform:
+            try:
+                payload = transform(payload)
+            except Exception as e:
+                print(f"job_response: Error: {str(e)}")
+                return jsonify({'error': str(e), 'job_id': job.id}), 500
+        return jsonify(payload), status_code
+    return jsonify({**job.describe(), 'result_url': f'/api/jobs/{job.id}'}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = hsc_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return job_response(job, request.args.get('wait', 0))
+
 @app.route('/api/queryGalaxies', methods=['POST'])
 def query_galaxies():
     data = request.json
@@ -202,104 +482,75 @@ def query_galaxies():
     if not all([ra is not None, dec is not None]):
         return jsonify({'error': 'RA and Dec are required'}), 400
 
+    # A new search from the same client (a browser tab, by the id the frontend sends) supersedes the
+    # cutouts prefetched for its previous one; requests without an id are grouped by address
+    client_id = data.get('client_id')
+    client = str(client_id)[:64] if client_id else request.remote_addr
+
+    use_mirror = catalog_mirror is not None and radius <= HSC_MIRROR_MAX_RADIUS
+    if use_mirror:
+        galaxies = catalog_mirror.cone_search(ra, dec, radius)
+        if galaxies is not None:
+            print(f"query_galaxies: Answered from local mirror, {len(galaxies)} galaxies")
+            prefetch_galaxy_cutouts(client, galaxies)
+            return jsonify({'galaxies': galaxies})
+
     if not HSC_USER or not HSC_PASSWORD:
         print("query_galaxies: Error: HSC credentials not found in .env")
         return jsonify({'error': 'HSC credentials not configured'}), 500
 
     credential = {'account_name': HSC_USER, 'password': HSC_PASSWORD}
 
-    # Construct SQL query for galaxies within radius
-    sql = f"""
-    SELECT object_id, ra, dec, r_cmodel_mag
-    FROM pdr3_wide.forced
-    WHERE coneSearch(coord, {ra}, {dec}, {radius * 3600})
-    AND isprimary
-    AND r_cmodel_mag < 24
-    LIMIT 100
-    """
-
     try:
-        # Submit job
-        print(f"query_galaxies: Submitting SQL query: {sql}")
-        job = submit_job(credential, sql, out_format='csv')
-        job_id = job['id']
-        print(f"query_galaxies: Job submitted, id={job_id}")
-
-        # Wait for job to complete
-        block_until_job_finishes(credential, job_id)
-        print(f"query_galaxies: Job {job_id} completed")
-
-        # Download results
-        result_csv = download_job(credential, job_id)
-        print(f"query_galaxies: Downloaded results, raw_csv={result_csv}")
-
-        # Split CSV lines
-        csv_lines = result_csv.splitlines()
-        if not csv_lines:
-            print("query_galaxies: Error: Empty CSV response")
-            return jsonify({'galaxies': [], 'warning': 'No data returned from HSC API'}), 200
-
-        # Find the header row
-        header_row = None
-        header_index = -1
-        expected_header = 'object_id,ra,dec,r_cmodel_mag'
-        for i, line in enumerate(csv_lines):
-            cleaned_line = line.strip().replace('\ufeff', '')  # Remove BOM
-            # Accept header with or without '#'
-            if cleaned_line == expected_header or cleaned_line == f'# {expected_header}':
-                header_row = expected_header  # Use clean header
-                header_index = i
-                print(f"query_galaxies: Found header at line {i}: '{cleaned_line}'")
-                break
-            print(f"query_galaxies: Checking line {i}: '{cleaned_line}'")
-
-        if not header_row:
-            print("query_galaxies: Error: Header row 'object_id,ra,dec,r_cmodel_mag' not found")
-            return jsonify({'galaxies': [], 'warning': 'CSV header not found'}), 200
-
-        # Get data rows after header
-        data_lines = [line.strip() for line in csv_lines[header_index + 1:] if line.strip() and not line.strip().startswith('#')]
-        if not data_lines:
-            print("query_galaxies: Error: No data rows after header")
-            return jsonify({'galaxies': [], 'warning': 'No data rows found'}), 200
-
-        # Parse CSV with DictReader
-        reader = csv.DictReader([header_row] + data_lines)
-        headers = reader.fieldnames
-        print(f"query_galaxies: CSV headers={headers}")
-
-        if not headers:
-            print("query_galaxies: Error: No headers parsed")
-            return jsonify({'galaxies': [], 'warning': 'Invalid CSV format'}), 200
-
-        # Check expected columns
-        expected_columns = ['object_id', 'ra', 'dec', 'r_cmodel_mag']
-        if not all(col in headers for col in expected_columns):
-            print(f"query_galaxies: Error: Missing expected columns, found={headers}")
-            return jsonify({'galaxies': [], 'warning': f"Expected columns {expected_columns}, got {headers}"}), 200
-
-        # Parse rows
-        galaxies = []
-        for row in reader:
-            try:
-                galaxies.append({
-                    'id': row['object_id'],
-                    'ra': float(row['ra']),
-                    'dec': float(row['dec']),
-                    'magnitude': float(row['r_cmodel_mag']) if row['r_cmodel_mag'] else 0.0,
-                    'distance': 0.0  # Placeholder
-                })
-            except (KeyError, ValueError) as e:
-                print(f"query_galaxies: Warning: Skipping row due to error={str(e)}, row={row}")
-                continue
-
-        print(f"query_galaxies: Parsed {len(galaxies)} galaxies, data={galaxies}")
-        return jsonify({'galaxies': galaxies})
+        # Submit job; the scheduler polls it and the result is fetched by id or long-polled here
+        if use_mirror:
+            # Fetch every pixel the cone touches, write them to the mirror, then answer from it
+            sql = catalog_mirror.fill_sql(ra, dec, radius)
+            print(f"query_galaxies: Submitting mirror fill query: {sql}")
+            job = hsc_jobs.submit(credential, sql, lambda result_csv: fill_mirror(ra, dec, radius, result_csv),
+                                  kind='queryGalaxiesFill')
+        else:
+            sql = galaxies_sql(ra, dec, radius)
+            print(f"query_galaxies: Submitting SQL query: {sql}")
+            job = hsc_jobs.submit(credential, sql, parse_galaxies_csv, kind='queryGalaxies')
+        def prefetch_when_done(job):
+            if job.status == 'done':
+                prefetch_galaxy_cutouts(client, job.result[0].get('galaxies', []))
+        hsc_jobs.add_done_callback(job, prefetch_when_done)
+        return job_response(job, data.get('wait', HSC_JOB_WAIT))
 
     except Exception as e:
         print(f"query_galaxies: Error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/queryGalaxiesPhotoz', methods=['POST'])
+def query_galaxies_photoz():
+    """Cone search returning each galaxy's five-band magnitudes, photo-z redshift and comoving distance."""
+    data = request.json
+    ra = data.get('ra')
+    dec = data.get('dec')
+    radius = data.get('radius', 10 / 3600)  # Default: 10 arcseconds
+    print(f"query_galaxies_photoz: Received RA={ra}, Dec={dec}, Radius={radius}")
+
+    if not all([ra is not None, dec is not None]):
+        return jsonify({'error': 'RA and Dec are required'}), 400
+
+    if not HSC_USER or not HSC_PASSWORD:
+        print("query_galaxies_photoz: Error: HSC credentials not found in .env")
+        return jsonify({'error': 'HSC credentials not configured'}), 500
+
+    credential = {'account_name': HSC_USER, 'password': HSC_PASSWORD}
+    sql = galaxies_photoz_sql(ra, dec, radius)
+
+    try:
+        print(f"query_galaxies_photoz: Submitting SQL query: {sql}")
+        job = hsc_jobs.submit(credential, sql, parse_photoz_csv, kind='queryGalaxiesPhotoz')
+        return job_response(job, data.get('wait', HSC_JOB_WAIT))
+
+    except Exception as e:
+        print(f"query_galaxies_photoz: Error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/queryGalaxyDetails', methods=['POST'])
 def query_galaxy_details():
     data = request.json
@@ -309,122 +560,228 @@ def query_galaxy_details():
     if not object_id:
         return jsonify({'error': 'object_id is required'}), 400
 
+    try:
+        object_id = str(int(object_id))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'object_id must be an integer'}), 400
+
     if not HSC_USER or not HSC_PASSWORD:
         print("query_galaxy_details: Error: HSC credentials not found in .env")
         return jsonify({'error': 'HSC credentials not configured'}), 500
 
     credential = {'account_name': HSC_USER, 'password': HSC_PASSWORD}
 
-    # Construct SQL query for additional galaxy details
-    sql = f"""
-    SELECT object_id, ra, dec, g_cmodel_mag, r_cmodel_mag, i_cmodel_mag, z_cmodel_mag, y_cmodel_mag
-    FROM pdr3_wide.forced
-    WHERE object_id = {object_id}
-    AND isprimary
-    LIMIT 1
-    """
-
     try:
-        # Submit job
-        print(f"query_galaxy_details: Submitting SQL query: {sql}")
-        job = submit_job(credential, sql, out_format='csv')
-        job_id = job['id']
-        print(f"query_galaxy_details: Job submitted, id={job_id}")
-
-        # Wait for job to complete
-        block_until_job_finishes(credential, job_id)
-        print(f"query_galaxy_details: Job {job_id} completed")
-
-        # Download results
-        result_csv = download_job(credential, job_id)
-        print(f"query_galaxy_details: Downloaded results, raw_csv={result_csv}")
-
-        # Split CSV lines
-        csv_lines = result_csv.splitlines()
-        if not csv_lines:
-            print("query_galaxy_details: Error: Empty CSV response")
-            return jsonify({'details': {}, 'warning': 'No data returned from HSC API'}), 200
-
-        # Find the header row
-        header_row = None
-        header_index = -1
-        expected_header = 'object_id,ra,dec,g_cmodel_mag,r_cmodel_mag,i_cmodel_mag,z_cmodel_mag,y_cmodel_mag'
-        for i, line in enumerate(csv_lines):
-            cleaned_line = line.strip().replace('\ufeff', '')
-            if cleaned_line == expected_header or cleaned_line == f'# {expected_header}':
-                header_row = expected_header
-                header_index = i
-                print(f"query_galaxy_details: Found header at line {i}: '{cleaned_line}'")
-                break
-
-        if not header_row:
-            print("query_galaxy_details: Error: Header row not found")
-            return jsonify({'details': {}, 'warning': 'CSV header not found'}), 200
-
-        # Get data rows after header
-        data_lines = [line.strip() for line in csv_lines[header_index + 1:] if line.strip() and not line.strip().startswith('#')]
-        if not data_lines:
-            print("query_galaxy_details: Error: No data rows after header")
-            return jsonify({'details': {}, 'warning': 'No data rows found'}), 200
-
-        # Parse CSV with DictReader
-        reader = csv.DictReader([header_row] + data_lines)
-        headers = reader.fieldnames
-        print(f"query_galaxy_details: CSV headers={headers}")
-
-        if not headers:
-            print("query_galaxy_details: Error: No headers parsed")
-            return jsonify({'details': {}, 'warning': 'Invalid CSV format'}), 200
-
-        # Check expected columns
-        expected_columns = ['object_id', 'ra', 'dec', 'g_cmodel_mag', 'r_cmodel_mag', 'i_cmodel_mag', 'z_cmodel_mag', 'y_cmodel_mag']
-        if not all(col in headers for col in expected_columns):
-            print(f"query_galaxy_details: Error: Missing expected columns, found={headers}")
-            return jsonify({'details': {}, 'warning': f"Expected columns {expected_columns}, got {headers}"}), 200
-
-        # Parse row
-        details = {}
-        for row in reader:
-            try:
-                details = {
-                    'object_id': row['object_id'],
-                    'ra': float(row['ra']) if row['ra'] else None,
-                    'dec': float(row['dec']) if row['dec'] else None,
-                    'g_mag': float(row['g_cmodel_mag']) if row['g_cmodel_mag'] else None,
-                    'r_mag': float(row['r_cmodel_mag']) if row['r_cmodel_mag'] else None,
-                    'i_mag': float(row['i_cmodel_mag']) if row['i_cmodel_mag'] else None,
-                    'z_mag': float(row['z_cmodel_mag']) if row['z_cmodel_mag'] else None,
-                    'y_mag': float(row['y_cmodel_mag']) if row['y_cmodel_mag'] else None,
-                    'redshift': None,  # Placeholder (add redshift query if available)
-                    'morphology': None,  # Placeholder (add morphology query if available)
-                }
-                break
-            except (KeyError, ValueError) as e:
-                print(f"query_galaxy_details: Warning: Skipping row due to error={str(e)}, row={row}")
-                continue
-
-        print(f"query_galaxy_details: Parsed details, data={details}")
-        return jsonify({'details': details})
+        # Lookups arriving together share one IN-list job; each caller still gets its own job id
+        job = details_coalescer.lookup(credential, object_id)
+        return job_response(job, data.get('wait', HSC_JOB_WAIT))
 
     except Exception as e:
         print(f"query_galaxy_details: Error: {str(e)}")
         return jsonify({'error': str(e)}), 500
-import base64
-from io import BytesIO
 from urllib.parse import urlencode
 import requests
-import matplotlib
-matplotlib.use('Agg')  # Set non-interactive backend
-import matplotlib.pyplot as plt
-from astropy.io import fits
 import numpy as np
 import os
-import time
 
-# Ensure the cutouts directory exists
+# Ensure the cutouts directory exists; it holds the on-disk cutout cache
 CUTOUT_DIR = os.path.join(os.path.dirname(__file__), 'cutouts')
 os.makedirs(CUTOUT_DIR, exist_ok=True)
 
+# Byte budget of the cutout cache (raw FITS plus rendered images); 0 disables it
+CUTOUT_CACHE_BYTES = int(os.getenv('CUTOUT_CACHE_BYTES', str(2 * 1024 * 1024 * 1024)))
+cutout_cache = CutoutCache(CUTOUT_DIR, CUTOUT_CACHE_BYTES) if CUTOUT_CACHE_BYTES > 0 else None
+
+cutout_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CUTOUT_WORKERS, thread_name_prefix='cutout')
+gallery_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CUTOUT_GALLERY_WORKERS, thread_name_prefix='cutout-gallery')
+
+def download_cutout_fits(key, rerun, filter_type, ra, dec, sw, sh, request_priority='interactive'):
+    """Raw FITS bytes of one band's cutout, from the cutout cache or else from DAS."""
+    fits_data = cutout_cache.get(key, 'fits') if cutout_cache else None
+    if fits_data is not None:
+        return fits_data
+
+    # Construct the cutout URL
+    params = {
+        'ra': ra,
+        'dec': dec,
+        'filter': filter_type,
+        'sw': f'{sw}arcmin',
+        'sh': f'{sh}arcmin',
+        'image': 'true',
+        'variance': 'false',
+        'mask': 'false',
+        'rerun': rerun,
+    }
+    url = f"https://hsc-release.mtk.nao.ac.jp/das_cutout/pdr3/cgi-bin/cutout?{urlencode(params)}"
+    print(f"fetch_cutout: Fetching cutout, url={url}, filter={filter_type}")
+
+    # Make the request with authentication
+    auth = (HSC_USER, HSC_PASSWORD)
+    with governor.slot('das_cutout', request_priority):
+        response = requests.get(url, auth=auth, timeout=30)
+    response.raise_for_status()
+    if cutout_cache:
+        cutout_cache.set(key, 'fits', response.content)
+    return response.content
+
+def cutout_address(rerun, ra, dec, sw, sh, size, fmt, stretch=None, band=None, composite=None):
+    """Cache key and variant of one rendering: a single band with a stretch, or a composite of three bands."""
+    if composite:
+        return cutout_key(rerun, '+'.join(composite), ra, dec, sw, sh), f'lupton-{size}-v{RENDER_VERSION}.{fmt}'
+    # Each rendering of the same cutout is its own cache entry next to the shared FITS
+    return cutout_key(rerun, band, ra, dec, sw, sh), f'{stretch}-{size}-v{RENDER_VERSION}.{fmt}'
+
+def cutout_image(rerun, filter_type, ra, dec, sw, sh, stretch, size, fmt, request_priority='interactive'):
+    """Rendered image of one band's cutout; a cached rendering never touches DAS or the renderer."""
+    key, variant = cutout_address(rerun, ra, dec, sw, sh, size, fmt, stretch=stretch, band=filter_type)
+    image_data = cutout_cache.get(key, variant) if cutout_cache else None
+    if image_data is None:
+        fits_data = download_cutout_fits(key, rerun, filter_type, ra, dec, sw, sh, request_priority)
+        image_data = render_cutout(fits_data, stretch, size, fmt)
+        if cutout_cache:
+            cutout_cache.set(key, variant, image_data)
+    return image_data
+
+def cutout_composite(rerun, bands, ra, dec, sw, sh, size, fmt, request_priority='interactive', concurrent=True):
+    """Lupton RGB composite of three bands' cutouts, cached next to the per-band FITS it is built from.
+
+    Called from a cutout worker, pass ``concurrent=False`` so the bands are
+    fetched in-line instead of waiting on other tasks of the same pool.
+    """
+    key, variant = cutout_address(rerun, ra, dec, sw, sh, size, fmt, composite=bands)
+    image_data = cutout_cache.get(key, variant) if cutout_cache else None
+    if image_data is None:
+        downloads = [(cutout_key(rerun, band, ra, dec, sw, sh), rerun, band, ra, dec, sw, sh, request_priority) for band in bands]
+        if concurrent:
+            # The three bands download concurrently, each through the cache and the DAS lane
+            futures = [cutout_executor.submit(download_cutout_fits, *args) for args in downloads]
+            fits_data = [future.result() for future in futures]
+        else:
+            fits_data = [download_cutout_fits(*args) for args in downloads]
+        image_data = render_composite(*fits_data, size=size, fmt=fmt)
+        if cutout_cache:
+            cutout_cache.set(key, variant, image_data)
+    return image_data
+
+def cutout_options(params):
+    """Validated (stretch, size, format) of a cutout request; raises ValueError naming the bad field."""
+    stretch = params.get('stretch', CUTOUT_STRETCH)
+    fmt = params.get('format', CUTOUT_FORMAT)
+    if stretch not in STRETCHES:
+        raise ValueError(f"stretch must be one of {list(STRETCHES)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
+    try:
+        size = int(params.get('size', CUTOUT_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError('size must be an integer') from None
+    if not 16 <= size <= 2048:
+        raise ValueError('size must be between 16 and 2048 pixels')
+    return stretch, size, fmt
+
+def cutout_url(rerun, ra, dec, sw, sh, size, fmt, stretch=None, band=None, composite=None, request_priority='interactive'):
+    """Stable URL of one rendering; the same cutout parameters always give the same URL."""
+    params = {
+        'rerun': rerun,
+        'ra': round(float(ra), 7),
+        'dec': round(float(dec), 7),
+        'sw': round(float(sw), 7),
+        'sh': round(float(sh), 7),
+        'size': size,
+        'format': fmt,
+        'v': RENDER_VERSION,
+    }
+    if composite:
+        params['composite'] = ','.join(composite)
+    else:
+        params['band'] = band
+        params['stretch'] = stretch
+    if request_priority != 'interactive':
+        params['priority'] = request_priority
+    return url_for('get_cutout_image', **params)
+
+# Renderings never change for a given URL (the release is frozen and RENDER_VERSION is part of it)
+CUTOUT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def prefetch_cutout(item):
+    """Render one band of a likely next cutout into the cache, behind every interactive DAS call."""
+    ra, dec, band = item
+    cutout_image('pdr3_wide', band, ra, dec, 0.0896, 0.0896, CUTOUT_STRETCH, CUTOUT_SIZE, CUTOUT_FORMAT, 'background')
+
+# Prefetching only helps if there is a cache to warm
+cutout_prefetcher = (
+    CutoutPrefetcher(prefetch_cutout, CUTOUT_PREFETCH_WORKERS, CUTOUT_PREFETCH_MAX_PENDING)
+    if CUTOUT_PREFETCH_COUNT > 0 and cutout_cache and HSC_USER and HSC_PASSWORD else None
+)
+
+def prefetch_galaxy_cutouts(client, galaxies):
+    """Queue the default cutouts of the brightest ``galaxies``, as the dashboard will request them on a click."""
+    if not cutout_prefetcher:
+        return
+    # A magnitude of 0 stands for a missing one
+    ranked = sorted((galaxy for galaxy in galaxies if galaxy.get('magnitude')), key=lambda galaxy: galaxy['magnitude'])
+    items = [(galaxy['ra'], galaxy['dec'], band) for galaxy in ranked[:CUTOUT_PREFETCH_COUNT] for band in CUTOUT_PREFETCH_BANDS]
+    cutout_prefetcher.prefetch(client, items)
+
+@app.route('/api/cutoutImage', methods=['GET'])
+def get_cutout_image():
+    params = request.args
+    ra = params.get('ra', type=float)
+    dec = params.get('dec', type=float)
+    sw = params.get('sw', 0.0896, type=float)  # arcmin
+    sh = params.get('sh', 0.0896, type=float)  # arcmin
+    rerun = params.get('rerun', 'pdr3_wide')
+    band = params.get('band')
+    composite = params.get('composite')
+    request_priority = params.get('priority', 'interactive')
+
+    if ra is None or dec is None:
+        return jsonify({'error': 'RA and Dec are required'}), 400
+
+    if bool(band) == bool(composite):
+        return jsonify({'error': 'exactly one of band or composite is required'}), 400
+
+    if composite:
+        composite = composite.split(',')
+        if len(composite) != 3:
+            return jsonify({'error': 'composite must list three bands, red first'}), 400
+
+    if request_priority not in PRIORITY_CLASSES:
+        return jsonify({'error': f"priority must be one of {list(PRIORITY_CLASSES)}"}), 400
+
+    try:
+        stretch, size, fmt = cutout_options(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The address of the rendering is its strong validator, so a revalidation is answered without DAS or the renderer
+    key, variant = cutout_address(rerun, ra, dec, sw, sh, size, fmt, stretch=stretch, band=band, composite=composite)
+    etag = f'{key}.{variant}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = CUTOUT_CACHE_CONTROL
+        return response
+
+    if not HSC_USER or not HSC_PASSWORD:
+        print("get_cutout_image: Error: HSC credentials not found in .env")
+        return jsonify({'error': 'HSC credentials not configured'}), 500
+
+    try:
+        if composite:
+            image_data = cutout_composite(rerun, composite, ra, dec, sw, sh, size, fmt, request_priority)
+        else:
+            image_data = cutout_image(rerun, band, ra, dec, sw, sh, stretch, size, fmt, request_priority)
+    except Exception as e:
+        print(f"get_cutout_image: Error for {composite or band}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    response = Response(image_data, mimetype=FORMATS[fmt][1])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CUTOUT_CACHE_CONTROL
+    return response
+
 @app.route('/api/fetchCutout', methods=['POST'])
 def fetch_cutout():
     data = request.json
@@ -434,81 +791,133 @@ def fetch_cutout():
     sw = data.get('sw', 0.0896)  # arcmin
     sh = data.get('sh', 0.0896)  # arcmin
     rerun = data.get('rerun', 'pdr3_wide')
+    request_priority = data.get('priority', 'interactive')
+    composite = data.get('composite')
+    if composite is True:
+        composite = CUTOUT_COMPOSITE_BANDS
 
     if not all([ra is not None, dec is not None]):
         return jsonify({'error': 'RA and Dec are required'}), 400
 
+    try:
+        ra, dec, sw, sh = (float(value) for value in (ra, dec, sw, sh))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ra, dec, sw and sh must be numbers'}), 400
+    if not np.isfinite([ra, dec, sw, sh]).all():
+        return jsonify({'error': 'ra, dec, sw and sh must be finite'}), 400
+
+    if request_priority not in PRIORITY_CLASSES:
+        return jsonify({'error': f"priority must be one of {list(PRIORITY_CLASSES)}"}), 400
+
+    try:
+        stretch, size, fmt = cutout_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if composite and (not isinstance(composite, list) or len(composite) != 3 or not all(isinstance(band, str) for band in composite)):
+        return jsonify({'error': 'composite must be true or a list of three bands, red first'}), 400
+
     if not HSC_USER or not HSC_PASSWORD:
         print("fetch_cutout: Error: HSC credentials not found in .env")
         return jsonify({'error': 'HSC credentials not configured'}), 500
 
-    def process_band(filter_type):
+    # Only the image URLs are returned; the browser loads (and caches) each image separately
+    if composite:
+        return jsonify({'composite': {
+            'url': cutout_url(rerun, ra, dec, sw, sh, size, fmt, composite=composite, request_priority=request_priority),
+            'bands': composite,
+        }})
+
+    return jsonify({'cutouts': [
+        {
+            'url': cutout_url(rerun, ra, dec, sw, sh, size, fmt, stretch=stretch, band=band, request_priority=request_priority),
+            'filter': band,
+        }
+        for band in bands
+    ]})
+
+@app.route('/api/fetchCutoutGallery', methods=['POST'])
+def fetch_cutout_gallery():
+    data = request.json
+    positions = data.get('positions')
+    bands = data.get('bands', ['HSC-G', 'HSC-R', 'HSC-I', 'HSC-Z', 'HSC-Y'])
+    sw = data.get('sw', 0.0896)  # arcmin
+    sh = data.get('sh', 0.0896)  # arcmin
+    rerun = data.get('rerun', 'pdr3_wide')
+    request_priority = data.get('priority', 'interactive')
+    composite = data.get('composite')
+    if composite is True:
+        composite = CUTOUT_COMPOSITE_BANDS
+    print(f"fetch_cutout_gallery: Received positions={len(positions) if isinstance(positions, list) else None}, bands={composite or bands}")
+
+    if not isinstance(positions, list) or not positions:
+        return jsonify({'error': 'positions must be a non-empty list of {ra, dec}'}), 400
+
+    if len(positions) > CUTOUT_GALLERY_MAX_POSITIONS:
+        return jsonify({'error': f'at most {CUTOUT_GALLERY_MAX_POSITIONS} positions per request'}), 400
+
+    try:
+        coordinates = [(float(position['ra']), float(position['dec'])) for position in positions]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'every position needs a numeric ra and dec'}), 400
+
+    try:
+        sw, sh = float(sw), float(sh)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'sw and sh must be numbers'}), 400
+
+    if request_priority not in PRIORITY_CLASSES:
+        return jsonify({'error': f"priority must be one of {list(PRIORITY_CLASSES)}"}), 400
+
+    try:
+        stretch, size, fmt = cutout_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if composite and (not isinstance(composite, list) or len(composite) != 3 or not all(isinstance(band, str) for band in composite)):
+        return jsonify({'error': 'composite must be true or a list of three bands, red first'}), 400
+
+    if not HSC_USER or not HSC_PASSWORD:
+        print("fetch_cutout_gallery: Error: HSC credentials not found in .env")
+        return jsonify({'error': 'HSC credentials not configured'}), 500
+
+    # Every (position, band) rendering is one task on the gallery pool, which is bounded and separate from
+    # the interactive cutout pool, so a large gallery neither holds more than CUTOUT_GALLERY_WORKERS threads
+    # nor delays single cutouts; its downloads still queue behind the DAS lane
+    futures = {}
+    for index, (ra, dec) in enumerate(coordinates):
+        # The caller's own identifier (such as an object_id) is echoed back with each record
+        position_id = positions[index].get('id')
+        if composite:
+            future = gallery_executor.submit(cutout_composite, rerun, composite, ra, dec, sw, sh, size, fmt, request_priority, concurrent=False)
+            futures[future] = {'index': index, 'id': position_id, 'bands': composite}
+        else:
+            for band in bands:
+                future = gallery_executor.submit(cutout_image, rerun, band, ra, dec, sw, sh, stretch, size, fmt, request_priority)
+                futures[future] = {'index': index, 'id': position_id, 'filter': band}
+
+    def stream():
+        # One NDJSON record per rendering, in completion order. The rendered bytes travel in the record as a
+        # data URI, so the image is never fetched from DAS again even when the cutout cache is off or has
+        # evicted it; the stable URL is included for clients that want the browser-cacheable copy.
         try:
-            # Construct the cutout URL
-            params = {
-                'ra': ra,
-                'dec': dec,
-                'filter': filter_type,
-                'sw': f'{sw}arcmin',
-                'sh': f'{sh}arcmin',
-                'image': 'true',
-                'variance': 'false',
-                'mask': 'false',
-                'rerun': rerun,
-            }
-            url = f"https://hsc-release.mtk.nao.ac.jp/das_cutout/pdr3/cgi-bin/cutout?{urlencode(params)}"
-            print(f"fetch_cutout: Fetching cutout, url={url}, filter={filter_type}")
-
-            # Make the request with authentication
-            auth = (HSC_USER, HSC_PASSWORD)
-            response = requests.get(url, auth=auth, stream=True, timeout=30)
-            response.raise_for_status()
-
-            # Read the FITS file
-            hdul = fits.open(BytesIO(response.content))
-            data = hdul[1].data  # Get image data from the second HDU
-            hdul.close()
-
-            # Create a matplotlib figure for the image
-            fig = plt.figure(figsize=(4, 4))
-            plt.imshow(data, cmap='gray', origin='lower')
-            plt.axis('off')  # Hide axes
-
-            # Save to BytesIO for base64 encoding
-            buffer = BytesIO()
-            plt.savefig(buffer, format='jpeg', bbox_inches='tight', pad_inches=0, dpi=100)
-            buffer.seek(0)
-            image_data = buffer.getvalue()
-
-            # Convert to base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            mime_type = 'image/jpeg'
-
-            plt.close(fig)  # Close figure to free memory
-
-            print(f"fetch_cutout: Successfully converted cutout to JPEG, filter={filter_type}")
-            return {
-                'image': f'data:{mime_type};base64,{image_base64}',
-                'filter': filter_type,
-            }
-
-        except Exception as e:
-            print(f"fetch_cutout: Error for filter {filter_type}: {str(e)}")
-            return {
-                'filter': filter_type,
-                'error': str(e),
-            }
-
-    import concurrent.futures
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(bands)) as executor:
-        future_to_band = {executor.submit(process_band, band): band for band in bands}
-        for future in concurrent.futures.as_completed(future_to_band):
-            results.append(future.result())
-
-    # Sort results to match the order of bands
-    results.sort(key=lambda x: bands.index(x['filter']))
-
-    return jsonify({'cutouts': results})    
+            for future in concurrent.futures.as_completed(futures):
+                record = dict(futures[future])
+                ra, dec = coordinates[record['index']]
+                try:
+                    image_data = future.result()
+                    record['image'] = f"data:{FORMATS[fmt][1]};base64,{base64.b64encode(image_data).decode('ascii')}"
+                    record['url'] = cutout_url(rerun, ra, dec, sw, sh, size, fmt, stretch=stretch, band=record.get('filter'), composite=record.get('bands'))
+                except Exception as e:
+                    print(f"fetch_cutout_gallery: Error for position {record['index']}: {str(e)}")
+                    record['error'] = str(e)
+                yield json.dumps(record) + '\n'
+        finally:
+            # A client that goes away leaves nothing queued behind it
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=7333)
\ No newline at end of file
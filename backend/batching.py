@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Gathers concurrent single-row requests into batches for one run function.
+
+    Callers block in :meth:`submit` while a background thread drains the queue,
+    stacks up to ``max_batch_size`` rows (waiting at most ``max_wait`` seconds
+    after the first one arrives), calls ``run_fn`` once on the (N, F) batch and
+    hands each caller its own output row.
+    """
+
+    def __init__(self, run_fn, max_batch_size=64, max_wait=0.002):
+        self.run_fn = run_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._max_seen = 0
+        self._histogram = {}
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queue one feature row and block until its prediction is ready."""
+        future = Future()
+        self._queue.put((np.asarray(row, dtype=np.float32).reshape(-1), future))
+        return future.result()
+
+    def stats(self):
+        """Queue depth and achieved batch sizes since start-up."""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'rows': self._rows,
+                'mean_batch_size': self._rows / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_seen,
+                'batch_size_histogram': dict(sorted(self._histogram.items())),
+            }
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            self._record(len(items))
+            # Rows of different widths cannot share a tensor, so run each width separately
+            groups = {}
+            for row, future in items:
+                groups.setdefault(row.shape[0], []).append((row, future))
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, group):
+        try:
+            output = self.run_fn(np.stack([row for row, _ in group]))
+        except Exception as e:
+            for _, future in group:
+                future.set_exception(e)
+            return
+        for i, (_, future) in enumerate(group):
+            future.set_result(output[i:i + 1])
+
+    def _record(self, size):
+        with self._lock:
+            self._batches += 1
+            self._rows += size
+            self._max_seen = max(self._max_seen, size)
+            self._histogram[size] = self._histogram.get(size, 0) + 1
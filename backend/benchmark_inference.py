@@ -0,0 +1,265 @@
+"""Offline latency/throughput benchmark for the inference service.
+
+Sweeps batch size, ORT intra-op threads and client concurrency against the
+bundled model, both on a raw InferenceSession and through the FastAPI app
+driven in-process over ASGI (no network, no extra HTTP client dependency).
+Reports p50/p95/p99 latency, rows/sec and the resident memory sampled while
+each case ran (its peak, and its growth over the RSS the case started at) as
+JSON and markdown::
+
+    python benchmark_inference.py
+    python benchmark_inference.py --batch-sizes 1 64 1024 --threads 1 4 --concurrency 1 8 --report reports/benchmark.md
+
+The app is imported once, so its thread settings come from the usual
+INFERENCE_* environment variables; the prediction cache is disabled unless
+``--with-cache`` is given, since repeated rows would otherwise measure the cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+from model_session import build_session, normalize
+
+FEATURES = 5
+
+
+def current_rss_mb():
+    """Resident set size of this process right now (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+class RSSSampler:
+    """Samples RSS on a background thread for the duration of one case.
+
+    ru_maxrss is a high-water mark for the whole process, so every case
+    would inherit the peaks of the cases before it; sampling gives each case
+    its own peak and its growth over the RSS it started with.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak = max(self.peak or 0.0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stats(self):
+        return {
+            'peak_rss_mb': self.peak,
+            'rss_delta_mb': self.peak - self.start if self.start is not None else None,
+        }
+
+
+def summarize(latencies, rows, elapsed, memory):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'rows_per_sec': rows / elapsed,
+        'calls': len(latencies),
+        **memory.stats(),
+    }
+
+
+def random_magnitudes(rows, seed=0):
+    return np.random.default_rng(seed).uniform(18.0, 26.0, (rows, FEATURES)).astype(np.float32)
+
+
+def bench_session(model_path, batch_sizes, threads, duration):
+    """Time normalize + session.run on a raw session for every (threads, batch size)."""
+    results = []
+    for thread_count in threads:
+        session = build_session(model_path, intra_op_threads=thread_count, inter_op_threads=1)
+        for batch_size in batch_sizes:
+            with RSSSampler() as memory:
+                batch = random_magnitudes(batch_size)
+                session.run(['output'], {'input': normalize(batch)})
+                latencies = []
+                start = time.perf_counter()
+                while time.perf_counter() - start < duration:
+                    call_start = time.perf_counter()
+                    session.run(['output'], {'input': normalize(batch)})
+                    latencies.append(time.perf_counter() - call_start)
+                elapsed = time.perf_counter() - start
+            result = summarize(latencies, batch_size * len(latencies), elapsed, memory)
+            result.update({'path': 'session', 'threads': thread_count, 'batch_size': batch_size, 'concurrency': 1})
+            results.append(result)
+            print(f"bench_session: threads={thread_count} batch={batch_size} p50={result['p50_ms']:.3f}ms rows/s={result['rows_per_sec']:.0f}")
+    return results
+
+
+async def asgi_request(app, method, path, body, headers):
+    """Call an ASGI app once and return (status, body)."""
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {'status': None, 'body': bytearray()}
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        'client': ('127.0.0.1', 0),
+        'server': ('127.0.0.1', 80),
+    }
+    await app(scope, receive, send)
+    return response['status'], bytes(response['body'])
+
+
+def app_payloads(batch_size):
+    """(label, path, body, headers) for the JSON and binary variants of one batch size."""
+    batch = random_magnitudes(batch_size, seed=batch_size)
+    if batch_size == 1:
+        return [
+            ('json', '/predict', json.dumps({'data': batch[0].tolist()}).encode(), {'content-type': 'application/json'}),
+            ('octet-stream', '/predict', batch[0].tobytes(), {'content-type': 'application/octet-stream'}),
+        ]
+    return [
+        ('json', '/predict_batch', json.dumps({'data': batch.tolist()}).encode(), {'content-type': 'application/json'}),
+        ('octet-stream', '/predict_batch', batch.tobytes(), {'content-type': 'application/octet-stream'}),
+    ]
+
+
+async def bench_app_case(app, path, body, headers, concurrency, duration):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            call_start = time.perf_counter()
+            status, content = await asgi_request(app, 'POST', path, body, headers)
+            if status != 200:
+                raise RuntimeError(f"{path} returned {status}: {content[:200]!r}")
+            latencies.append(time.perf_counter() - call_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def bench_app(batch_sizes, concurrency_levels, duration):
+    """Drive /predict and /predict_batch in-process for every (batch size, concurrency)."""
+    import inference
+
+    results = []
+    for batch_size in batch_sizes:
+        for body_format, path, body, headers in app_payloads(batch_size):
+            asyncio.run(asgi_request(inference.app, 'POST', path, body, headers))
+            for concurrency in concurrency_levels:
+                with RSSSampler() as memory:
+                    latencies, elapsed = asyncio.run(bench_app_case(inference.app, path, body, headers, concurrency, duration))
+                result = summarize(latencies, batch_size * len(latencies), elapsed, memory)
+                result.update({
+                    'path': f"app {path} ({body_format})",
+                    'threads': inference.sessions[inference.DEFAULT_MODEL].get_session_options().intra_op_num_threads,
+                    'batch_size': batch_size,
+                    'concurrency': concurrency,
+                })
+                results.append(result)
+                print(f"bench_app: {path} {body_format} batch={batch_size} concurrency={concurrency} p99={result['p99_ms']:.3f}ms rows/s={result['rows_per_sec']:.0f}")
+    return results
+
+
+def megabytes(value):
+    return 'n/a' if value is None else f"{value:.1f}"
+
+
+def markdown(report):
+    lines = [
+        "# Inference benchmark",
+        "",
+        f"Model: {report['model']}, host: {report['host']['machine']} with {report['host']['cpus']} CPUs, "
+        f"{report['duration_s']} s per case",
+        "",
+        "| path | threads | batch | concurrency | p50 ms | p95 ms | p99 ms | rows/s | peak RSS MB | RSS growth MB |",
+        "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |",
+    ]
+    for r in report['results']:
+        lines.append(
+            f"| {r['path']} | {r['threads']} | {r['batch_size']} | {r['concurrency']} | {r['p50_ms']:.3f} | "
+            f"{r['p95_ms']:.3f} | {r['p99_ms']:.3f} | {r['rows_per_sec']:.0f} | {megabytes(r['peak_rss_mb'])} | "
+            f"{megabytes(r['rss_delta_mb'])} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=os.getenv('INFERENCE_MODEL_PATH', 'main_network.onnx'))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 256, 4096])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per case')
+    parser.add_argument('--skip-app', action='store_true', help='only benchmark the raw session')
+    parser.add_argument('--with-cache', action='store_true', help='leave the prediction cache enabled')
+    parser.add_argument('--report', default='reports/benchmark.md')
+    args = parser.parse_args()
+
+    if not args.with_cache:
+        os.environ['INFERENCE_CACHE_SIZE'] = '0'
+    os.environ['INFERENCE_MODEL_PATH'] = args.model
+
+    results = bench_session(args.model, args.batch_sizes, args.threads, args.duration)
+    if not args.skip_app:
+        results += bench_app(args.batch_sizes, args.concurrency, args.duration)
+
+    report = {
+        'model': args.model,
+        'duration_s': args.duration,
+        'host': {'machine': platform.machine(), 'cpus': os.cpu_count(), 'python': platform.python_version()},
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w') as f:
+        f.write(markdown(report))
+    with open(os.path.splitext(args.report)[0] + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print(markdown(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""Bulk photo-z over CSV/Parquet files in bounded memory.
+
+A job reads its input in ``chunk_rows`` chunks, scores each chunk and appends
+the predictions to ``output.csv`` before moving on, so memory use does not
+depend on the input size. After every chunk the job directory's ``job.json``
+is atomically rewritten with the rows done and the output size; a resumed job
+truncates the output back to that size and skips the rows already written.
+
+Jobs can also be run without the service::
+
+    python bulk_job.py extract.parquet --jobs-dir jobs
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from hsc_csv import find_header
+
+FEATURE_COLUMNS = ['g_cmodel_mag', 'r_cmodel_mag', 'i_cmodel_mag', 'z_cmodel_mag', 'y_cmodel_mag']
+ID_COLUMN = 'object_id'
+CHUNK_ROWS = 100_000
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def iter_chunks(path, columns, chunk_rows, skip_rows=0):
+    """Yield (DataFrame, fraction of input consumed) chunks, skipping ``skip_rows`` data rows."""
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        yield from _iter_parquet(path, columns, chunk_rows, skip_rows)
+        return
+    size = os.path.getsize(path) or 1
+    with open(path, 'rb') as handle:
+        reader = pd.read_csv(
+            handle,
+            names=find_header(handle, columns),
+            header=None,
+            usecols=columns,
+            chunksize=chunk_rows,
+            comment='#',
+            skip_blank_lines=True,
+        )
+        # Rows already done are counted in parsed records, as rows_done is; comment and blank
+        # lines would shift a line-based skip
+        for chunk in reader:
+            if skip_rows:
+                skipped = min(skip_rows, len(chunk))
+                skip_rows -= skipped
+                chunk = chunk.iloc[skipped:]
+                if chunk.empty:
+                    continue
+            yield chunk, min(handle.tell() / size, 1.0)
+
+
+def _iter_parquet(path, columns, chunk_rows, skip_rows):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet input needs the pyarrow package; install it or convert the input to CSV")
+    parquet_file = pq.ParquetFile(path)
+    total = parquet_file.metadata.num_rows or 1
+    seen = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+        start = max(skip_rows - seen, 0)
+        seen += batch.num_rows
+        if start >= batch.num_rows:
+            continue
+        yield batch.slice(start).to_pandas(), seen / total
+
+
+class BulkJobManager:
+    """Runs bulk jobs on a small thread pool and keeps their state under ``jobs_dir``."""
+
+    def __init__(self, jobs_dir, predict_fn, max_concurrent=1):
+        self.jobs_dir = jobs_dir
+        self.predict_fn = predict_fn
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='bulk-job')
+        self._lock = threading.Lock()
+        self._running = set()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def valid_job_id(job_id):
+        return re.fullmatch(r'[0-9a-f]{32}', job_id or '') is not None
+
+    def submit(self, input_path, job_id=None, chunk_rows=CHUNK_ROWS, feature_columns=None, id_column=ID_COLUMN, model=None):
+        """Create a job for ``input_path`` and queue it."""
+        job_id = job_id or self.new_job_id()
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        state = {
+            'id': job_id,
+            'input_path': os.path.abspath(input_path),
+            'output_path': os.path.join(os.path.abspath(self.job_dir(job_id)), 'output.csv'),
+            'chunk_rows': chunk_rows,
+            'feature_columns': feature_columns or FEATURE_COLUMNS,
+            'id_column': id_column,
+            'model': model,
+            'status': 'queued',
+            'rows_done': 0,
+            'output_bytes': 0,
+            'progress': 0.0,
+            'error': None,
+            'created': time.time(),
+            'updated': time.time(),
+        }
+        self._save(state)
+        self._start(job_id)
+        return state
+
+    def resume(self, job_id):
+        """Restart a failed or interrupted job from its last checkpoint."""
+        state = self.status(job_id)
+        if state is None:
+            return None
+        if state['status'] != 'done' and job_id not in self._running:
+            state['status'] = 'queued'
+            state['error'] = None
+            self._save(state)
+            self._start(job_id)
+        return state
+
+    def status(self, job_id):
+        if not self.valid_job_id(job_id):
+            return None
+        path = os.path.join(self.job_dir(job_id), 'job.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _save(self, state):
+        state['updated'] = time.time()
+        write_json_atomic(os.path.join(self.job_dir(state['id']), 'job.json'), state)
+
+    def _start(self, job_id):
+        with self._lock:
+            self._running.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        state = self.status(job_id)
+        try:
+            state['status'] = 'running'
+            self._save(state)
+            self._process(state)
+            state['status'] = 'done'
+            state['progress'] = 1.0
+            print(f"BulkJobManager: Action=Job finished, id={job_id}, rows={state['rows_done']}")
+        except Exception as e:
+            state['status'] = 'error'
+            state['error'] = str(e)
+            print(f"BulkJobManager: Error: job {job_id} failed: {str(e)}")
+        finally:
+            self._save(state)
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _process(self, state):
+        features = state['feature_columns']
+        id_column = state['id_column']
+        columns = ([id_column] if id_column else []) + features
+        output_path = state['output_path']
+
+        # Drop anything written after the last checkpoint
+        mode = 'r+b' if os.path.exists(output_path) else 'wb'
+        with open(output_path, mode) as out:
+            out.truncate(state['output_bytes'])
+            out.seek(state['output_bytes'])
+            if state['output_bytes'] == 0:
+                header = ([id_column] if id_column else []) + ['redshift']
+                out.write((','.join(header) + '\n').encode())
+
+            chunks = iter_chunks(state['input_path'], columns, state['chunk_rows'], state['rows_done'])
+            for chunk, fraction in chunks:
+                magnitudes = chunk[features].to_numpy(dtype=np.float32)
+                valid = np.isfinite(magnitudes).all(axis=1)
+                redshift = np.full(len(chunk), np.nan, dtype=np.float32)
+                if valid.any():
+                    redshift[valid] = self.predict_fn(magnitudes[valid], state['model'])[:, 0]
+
+                result = pd.DataFrame({id_column: chunk[id_column].to_numpy()} if id_column else {})
+                result['redshift'] = redshift
+                result.to_csv(out, header=False, index=False, float_format='%.6g')
+                out.flush()
+                os.fsync(out.fileno())
+
+                state['rows_done'] += len(chunk)
+                state['output_bytes'] = out.tell()
+                state['progress'] = fraction
+                self._save(state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a bulk photo-z job in-process.")
+    parser.add_argument('input_path', nargs='?')
+    parser.add_argument('--jobs-dir', default='jobs')
+    parser.add_argument('--resume', metavar='JOB_ID', help='continue an interrupted job')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--model', default=None)
+    args = parser.parse_args()
+
+    # Importing the service loads and warms up the configured model variants
+    from inference import run_batch
+
+    manager = BulkJobManager(args.jobs_dir, lambda batch, model: run_batch(batch, model=model))
+    if args.resume:
+        state = manager.resume(args.resume)
+    elif args.input_path:
+        state = manager.submit(args.input_path, chunk_rows=args.chunk_rows, model=args.model)
+    else:
+        parser.error('input_path or --resume is required')
+    if state is None:
+        parser.error(f'no job {args.resume!r} in {args.jobs_dir}')
+    job_id = state['id']
+    while True:
+        state = manager.status(job_id)
+        print(f"bulk_job: id={job_id} status={state['status']} rows={state['rows_done']} progress={state['progress']:.1%}")
+        if state['status'] in ('done', 'error'):
+            break
+        time.sleep(2)
+
+
+if __name__ == '__main__':
+    main()
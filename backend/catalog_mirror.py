@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from hsc_csv import read_hsc_csv
+
+# Columns kept per pixel; each is one .npy file, memory-mapped on read
+COLUMNS = {'object_id': np.int64, 'ra': np.float64, 'dec': np.float64, 'r_cmodel_mag': np.float32}
+
+
+def ang2pix_nest(nside, ra, dec):
+    """HEALPix NESTED pixel index for ``ra``/``dec`` in degrees (``nside`` a power of two)."""
+    ra = np.atleast_1d(np.asarray(ra, dtype=np.float64))
+    dec = np.atleast_1d(np.asarray(dec, dtype=np.float64))
+    z = np.sin(np.radians(dec))
+    za = np.abs(z)
+    tt = np.mod(np.radians(ra), 2 * np.pi) / (np.pi / 2)  # in [0, 4)
+
+    face = np.empty(ra.shape, dtype=np.int64)
+    ix = np.empty(ra.shape, dtype=np.int64)
+    iy = np.empty(ra.shape, dtype=np.int64)
+
+    # Equatorial belt
+    eq = za <= 2 / 3
+    t1 = nside * (0.5 + tt[eq])
+    t2 = nside * z[eq] * 0.75
+    jp = (t1 - t2).astype(np.int64)
+    jm = (t1 + t2).astype(np.int64)
+    ifp = jp // nside
+    ifm = jm // nside
+    face[eq] = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps
+    pol = ~eq
+    ntt = np.minimum(tt[pol].astype(np.int64), 3)
+    tp = tt[pol] - ntt
+    tmp = nside * np.sqrt(3 * (1 - za[pol]))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z[pol] >= 0
+    face[pol] = np.where(north, ntt, ntt + 8)
+    ix[pol] = np.where(north, nside - jm - 1, jp)
+    iy[pol] = np.where(north, nside - jp - 1, jm)
+
+    # Interleave the bits of ix (even) and iy (odd) within the face
+    ipf = np.zeros(ra.shape, dtype=np.int64)
+    for bit in range(int(nside).bit_length() - 1):
+        ipf |= ((ix >> bit) & 1) << (2 * bit)
+        ipf |= ((iy >> bit) & 1) << (2 * bit + 1)
+    return face * nside * nside + ipf
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Great-circle separation in degrees (haversine, stable at small angles)."""
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    a = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+class CatalogMirror:
+    """Local copy of primary ``pdr3_wide.forced`` rows, partitioned by HEALPix pixel.
+
+    Each pixel that has been mirrored is a directory of memory-mapped NumPy
+    columns holding every primary object in the pixel with
+    ``r_cmodel_mag < mag_limit``. A cone search is answered locally when all
+    pixels covering the cone are present. Otherwise :meth:`fill_sql` gives a
+    remote query wide enough to contain every missing pixel, and
+    :meth:`write_back` stores the pixels from its result. The fill query is
+    capped at ``fill_max_rows`` rows; a download that reaches the cap may be
+    missing rows of any pixel, so it answers its cone but is not stored.
+    """
+
+    def __init__(self, directory, nside=1024, mag_limit=24.0, fill_max_rows=100_000):
+        if nside & (nside - 1):
+            raise ValueError(f"nside must be a power of two, got {nside}")
+        self.directory = os.path.join(directory, f'nside{nside}')
+        self.nside = nside
+        self.mag_limit = mag_limit
+        self.fill_max_rows = fill_max_rows
+        # Angular size of a pixel; no point of a pixel is farther than this from any other
+        self.resolution = np.degrees(np.sqrt(4 * np.pi / (12 * nside * nside)))
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.remote_fills = 0
+        self.pixels_written = 0
+        self.truncated_fills = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _pixel_dir(self, pixel):
+        return os.path.join(self.directory, str(int(pixel)))
+
+    def covering_pixels(self, ra, dec, radius):
+        """Pixels touched by the cone, found by sampling it more finely than the pixel size."""
+        step = self.resolution / 4
+        rings = np.arange(0, radius + step, step)
+        rings[-1] = radius
+        ring_ras, ring_decs = [np.array([ra])], [np.array([dec])]
+        for ring in rings[1:]:
+            # Enough points per ring that neighbours are no more than ``step`` apart
+            angles = np.linspace(0, 2 * np.pi, max(int(np.ceil(2 * np.pi * ring / step)), 8), endpoint=False)
+            ring_decs.append(np.clip(dec + ring * np.sin(angles), -90, 90))
+            ring_ras.append(ra + ring * np.cos(angles) / max(np.cos(np.radians(dec)), 1e-6))
+        return sorted(set(ang2pix_nest(self.nside, np.concatenate(ring_ras), np.concatenate(ring_decs)).tolist()))
+
+    def missing_pixels(self, pixels):
+        return [pixel for pixel in pixels if not os.path.isdir(self._pixel_dir(pixel))]
+
+    def _load(self, pixel):
+        directory = self._pixel_dir(pixel)
+        return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+
+    def cone_search(self, ra, dec, radius, limit=100):
+        """Galaxies within ``radius`` degrees from local pixels, nearest first, or None if any pixel is missing."""
+        pixels = self.covering_pixels(ra, dec, radius)
+        if self.missing_pixels(pixels):
+            return None
+        tiles = [self._load(pixel) for pixel in pixels]
+        columns = {name: np.concatenate([tile[name] for tile in tiles]) for name in COLUMNS}
+        with self._lock:
+            self.local_hits += 1
+        return self._nearest(columns, ra, dec, radius, limit)
+
+    def _nearest(self, columns, ra, dec, radius, limit):
+        separation = angular_separation(ra, dec, columns['ra'], columns['dec'])
+        keep = np.flatnonzero((separation <= radius) & (columns['r_cmodel_mag'] < self.mag_limit))
+        keep = keep[np.argsort(separation[keep], kind='stable')][:limit]
+        return [
+            {
+                'id': str(columns['object_id'][i]),
+                'ra': float(columns['ra'][i]),
+                'dec': float(columns['dec'][i]),
+                'magnitude': float(columns['r_cmodel_mag'][i]),
+                'distance': 0.0,  # Placeholder
+            }
+            for i in keep
+        ]
+
+    def fill_radius(self, radius):
+        """Radius of a cone that contains every pixel touching a cone of ``radius``."""
+        return radius + 2 * self.resolution
+
+    def fill_sql(self, ra, dec, radius):
+        """SQL returning every mirrored row in the pixels covering the cone, up to one row past ``fill_max_rows``."""
+        return f"""
+    SELECT object_id, ra, dec, r_cmodel_mag
+    FROM pdr3_wide.forced
+    WHERE coneSearch(coord, {ra}, {dec}, {self.fill_radius(radius) * 3600})
+    AND isprimary
+    AND r_cmodel_mag < {self.mag_limit}
+    LIMIT {self.fill_max_rows + 1}
+    """
+
+    def write_back(self, ra, dec, radius, result_csv, limit=100):
+        """Store the missing pixels of the cone from a :meth:`fill_sql` download and answer the cone from its rows."""
+        columns = parse_columns(result_csv)
+        if len(columns['object_id']) > self.fill_max_rows:
+            # The LIMIT cut the download short, so no pixel in it is known to be complete
+            with self._lock:
+                self.truncated_fills += 1
+            print(f"CatalogMirror: Warning: fill reached {self.fill_max_rows} rows, not storing it, ra={ra}, dec={dec}, radius={radius}")
+            return self._nearest(columns, ra, dec, radius, limit)
+        pixels = self.missing_pixels(self.covering_pixels(ra, dec, radius))
+        row_pixels = ang2pix_nest(self.nside, columns['ra'], columns['dec'])
+        for pixel in pixels:
+            rows = row_pixels == pixel
+            self._write_pixel(pixel, {name: values[rows] for name, values in columns.items()})
+        with self._lock:
+            self.remote_fills += 1
+            self.pixels_written += len(pixels)
+        print(f"CatalogMirror: Action=Wrote {len(pixels)} pixels from {len(row_pixels)} rows, ra={ra}, dec={dec}")
+        return self._nearest(columns, ra, dec, radius, limit)
+
+    def _write_pixel(self, pixel, columns):
+        # Write into a scratch directory and rename it into place, so readers never see half a pixel
+        scratch = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            for name, values in columns.items():
+                np.save(os.path.join(scratch, f'{name}.npy'), values)
+            with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+                json.dump({'pixel': int(pixel), 'nside': self.nside, 'rows': len(columns['object_id']), 'mag_limit': self.mag_limit}, f)
+            os.rename(scratch, self._pixel_dir(pixel))
+        except OSError:
+            # Another fill already wrote this pixel
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def stats(self):
+        pixels = [name for name in os.listdir(self.directory) if not name.startswith('.')]
+        with self._lock:
+            return {
+                'nside': self.nside,
+                'pixels': len(pixels),
+                'local_hits': self.local_hits,
+                'remote_fills': self.remote_fills,
+                'pixels_written': self.pixels_written,
+                'truncated_fills': self.truncated_fills,
+                'fill_max_rows': self.fill_max_rows,
+            }
+
+
+def parse_columns(result_csv):
+    """Parse an HSC download into typed column arrays, dropping rows with any mirrored column missing."""
+    table = read_hsc_csv(result_csv, COLUMNS).dropna()
+    return {name: table[name].to_numpy(dtype=dtype) for name, dtype in COLUMNS.items()}
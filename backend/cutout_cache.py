@@ -0,0 +1,74 @@
+import hashlib
+import json
+import threading
+
+import diskcache
+
+
+def cutout_key(rerun, filter_type, ra, dec, sw, sh, image=True, variance=False, mask=False):
+    """Content address of a DAS cutout request: a digest of its canonicalized parameters.
+
+    Coordinates are rounded to 1e-7 deg (~0.4 mas) so the same position
+    written with different float noise maps to the same entry.
+    """
+    canonical = json.dumps({
+        'rerun': rerun,
+        'filter': filter_type,
+        'ra': round(float(ra), 7),
+        'dec': round(float(dec), 7),
+        'sw': round(float(sw), 7),
+        'sh': round(float(sh), 7),
+        'image': bool(image),
+        'variance': bool(variance),
+        'mask': bool(mask),
+    }, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CutoutCache:
+    """On-disk store of raw FITS cutouts and images rendered from them.
+
+    Entries are addressed by :func:`cutout_key` plus a variant name
+    (``'fits'`` for the download, e.g. ``'asinh-320-v1.jpeg'`` for a rendering). The
+    ``diskcache`` store under ``directory`` is shared safely between threads
+    and worker processes, writes are atomic, and once it exceeds
+    ``size_limit`` bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, size_limit):
+        self._store = diskcache.Cache(directory, size_limit=size_limit, eviction_policy='least-recently-used')
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.bytes_written = 0
+
+    def get(self, key, variant):
+        value = self._store.get(f'{key}.{variant}')
+        with self._lock:
+            counts = self.misses if value is None else self.hits
+            counts[variant] = counts.get(variant, 0) + 1
+        return value
+
+    def set(self, key, variant, value):
+        self._store.set(f'{key}.{variant}', value)
+        with self._lock:
+            self.bytes_written += len(value)
+
+    def stats(self):
+        with self._lock:
+            variants = sorted(set(self.hits) | set(self.misses))
+            counts = {
+                variant: {
+                    'hits': self.hits.get(variant, 0),
+                    'misses': self.misses.get(variant, 0),
+                }
+                for variant in variants
+            }
+            bytes_written = self.bytes_written
+        return {
+            'variants': counts,
+            'entries': len(self._store),
+            'bytes': self._store.volume(),
+            'size_limit': self._store.size_limit,
+            'bytes_written': bytes_written,
+        }
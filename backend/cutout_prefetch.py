@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CutoutPrefetcher:
+    """Speculatively warms the cutout cache with renderings a user is likely to open next.
+
+    Each client has at most one prefetch outstanding: starting another (the
+    user searched somewhere else) cancels whatever of the previous one has
+    not started yet. Fetches run on a small pool of their own, so they never
+    hold cutout workers that interactive requests need, and no more than
+    ``max_pending`` are queued across all clients; items beyond that are
+    dropped, since they are only a guess.
+    """
+
+    def __init__(self, fetch_fn, workers=2, max_pending=200):
+        self.fetch_fn = fetch_fn
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cutout-prefetch')
+        self._lock = threading.Lock()
+        self._by_client = {}
+        self._pending = 0
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def prefetch(self, client, items):
+        """Queue ``fetch_fn(item)`` for each item in order, replacing ``client``'s previous prefetch."""
+        with self._lock:
+            previous = self._by_client.pop(client, [])
+        # Cancelling runs the done callback, which takes the lock
+        for future in previous:
+            future.cancel()
+
+        futures = []
+        with self._lock:
+            for item in items:
+                if self._pending >= self.max_pending:
+                    self.dropped += len(items) - len(futures)
+                    break
+                self._pending += 1
+                self.scheduled += 1
+                futures.append(self._executor.submit(self.fetch_fn, item))
+            # Forget clients whose prefetch has run its course
+            self._by_client = {
+                other: pending for other, pending in self._by_client.items()
+                if not all(future.done() for future in pending)
+            }
+            self._by_client[client] = futures
+        for future in futures:
+            future.add_done_callback(self._done)
+        if futures:
+            print(f"CutoutPrefetcher: Action=Queued, client={client}, items={len(futures)}, cancelled_previous={len(previous)}")
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled():
+                self.cancelled += 1
+            elif future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'clients': len(self._by_client),
+                'scheduled': self.scheduled,
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'failed': self.failed,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,117 @@
+import io
+
+import numpy as np
+from astropy.io import fits
+from astropy.visualization import ZScaleInterval
+from PIL import Image
+
+# Bumped whenever the pixels rendered for a cutout change, so cached renderings and image URLs from before are not reused
+RENDER_VERSION = 1
+# Intensity mappings from cutout pixel values to display levels
+STRETCHES = ('linear', 'asinh', 'zscale', 'percentile')
+# Output formats: Pillow encoder name and MIME type
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+# Pixels clipped at each end by the percentile and asinh stretches
+PERCENTILE_CLIP = (0.5, 99.5)
+# Softening of the asinh stretch as a fraction of the clipped range; smaller brings up faint structure more
+ASINH_SOFTENING = 0.1
+# Lupton et al. (2004) softening of colour composites; the asinh turns from linear to logarithmic near stretch / Q
+LUPTON_Q = 8.0
+
+
+def read_image(fits_data):
+    """Image HDU of a DAS cutout (the second HDU) as a float32 array."""
+    with fits.open(io.BytesIO(fits_data)) as hdul:
+        return np.asarray(hdul[1].data, dtype=np.float32)
+
+
+def _limits(finite, stretch):
+    if stretch == 'linear':
+        return finite.min(), finite.max()
+    if stretch == 'zscale':
+        return ZScaleInterval().get_limits(finite)
+    return tuple(np.percentile(finite, PERCENTILE_CLIP))
+
+
+def scale(data, stretch='linear'):
+    """Map ``data`` to display levels in [0, 1]; NaN and blank pixels become 0."""
+    if stretch not in STRETCHES:
+        raise ValueError(f"Unknown stretch {stretch!r}, expected one of {list(STRETCHES)}")
+    data = np.asarray(data, dtype=np.float32)
+    finite = data[np.isfinite(data)]
+    if finite.size == 0:
+        return np.zeros(data.shape, dtype=np.float32)
+    low, high = _limits(finite, stretch)
+    span = high - low if high > low else 1.0
+    levels = np.clip((data - low) / span, 0.0, 1.0)
+    if stretch == 'asinh':
+        levels = np.arcsinh(levels / ASINH_SOFTENING) / np.arcsinh(1.0 / ASINH_SOFTENING)
+    return np.nan_to_num(levels, nan=0.0)
+
+
+def lupton_rgb(red, green, blue, q=LUPTON_Q, stretch=None):
+    """(H, W, 3) levels in [0, 1] for three band images, after Lupton et al. (2004).
+
+    One asinh curve is applied to the mean intensity of the stacked bands
+    and every band is scaled by the same factor, so a source keeps its
+    colour however bright it is. Pixels pushed past 1 are scaled back as a
+    whole rather than clipped per band, for the same reason. ``stretch`` is
+    the intensity mapped to full brightness; by default the upper
+    percentile clip of the intensity.
+    """
+    channels = np.stack([np.asarray(band, dtype=np.float32) for band in (red, green, blue)], axis=-1)
+    channels = np.clip(np.nan_to_num(channels, nan=0.0), 0.0, None)
+    intensity = channels.mean(axis=-1)
+    if stretch is None:
+        stretch = np.percentile(intensity, PERCENTILE_CLIP[1])
+    stretch = stretch if stretch > 0 else 1.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(intensity > 0, np.arcsinh(q * intensity / stretch) / (np.arcsinh(q) * intensity), 0.0)
+    levels = channels * factor[..., None]
+    peak = levels.max(axis=-1, keepdims=True)
+    return np.where(peak > 1.0, levels / np.maximum(peak, 1.0), levels)
+
+
+def to_pixels(levels):
+    """8-bit pixels for [0, 1] levels, flipped so the first FITS row (south) ends up at the bottom."""
+    return np.flipud(np.rint(levels * 255.0).astype(np.uint8))
+
+
+def encode(pixels, size=None, fmt='jpeg', quality=90):
+    """Encode an (H, W) grey or (H, W, 3) RGB uint8 array, scaled so its longer side is ``size`` pixels."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {list(FORMATS)}")
+    image = Image.fromarray(np.ascontiguousarray(pixels))
+    if size:
+        width, height = image.size
+        factor = size / max(width, height)
+        target = (max(1, round(width * factor)), max(1, round(height * factor)))
+        if target != image.size:
+            # Keep pixels crisp when enlarging; average them when shrinking
+            resample = Image.Resampling.NEAREST if factor > 1 else Image.Resampling.LANCZOS
+            image = image.resize(target, resample)
+    buffer = io.BytesIO()
+    image.save(buffer, format=FORMATS[fmt][0], quality=quality)
+    return buffer.getvalue()
+
+
+def render_cutout(fits_data, stretch='linear', size=None, fmt='jpeg', quality=90):
+    """Render the image HDU of a FITS cutout straight to encoded image bytes.
+
+    Only NumPy and Pillow are involved, with no figure or global plotting
+    state, so any number of threads can render at once.
+    """
+    return encode(to_pixels(scale(read_image(fits_data), stretch)), size, fmt, quality)
+
+
+def render_composite(red, green, blue, size=None, fmt='jpeg', quality=90):
+    """Render a Lupton RGB composite of three FITS cutouts (raw bytes, reddest band first)."""
+    images = [read_image(fits_data) for fits_data in (red, green, blue)]
+    # Neighbouring bands can come back a pixel apart at patch edges; keep the common area
+    height = min(image.shape[0] for image in images)
+    width = min(image.shape[1] for image in images)
+    return encode(to_pixels(lupton_rgb(*(image[:height, :width] for image in images))), size, fmt, quality)
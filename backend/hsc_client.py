@@ -0,0 +1,158 @@
+import contextlib
+import io
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HSC_API_URL = 'https://hsc-release.mtk.nao.ac.jp/datasearch/api/catalog_jobs/'
+CLIENT_VERSION = 20190514.1
+
+# Connection pool and retry settings for the HSC catalog job API
+HSC_POOL_SIZE = int(os.getenv('HSC_POOL_SIZE', '16'))
+HSC_CONNECT_TIMEOUT = float(os.getenv('HSC_CONNECT_TIMEOUT', '10'))
+HSC_READ_TIMEOUT = float(os.getenv('HSC_READ_TIMEOUT', '120'))
+HSC_MAX_RETRIES = int(os.getenv('HSC_MAX_RETRIES', '3'))
+HSC_RETRY_BACKOFF = float(os.getenv('HSC_RETRY_BACKOFF', '0.5'))
+
+# Status codes worth retrying: throttling and transient server/gateway errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HSCHTTPError(Exception):
+    """An HSC API call answered with an error status (after any retries)."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"HTTP Error {status_code}: {text}")
+        self.status_code = status_code
+
+
+class ResponseStream(io.BufferedReader):
+    """Buffered binary stream over a streamed response body that calls ``release`` once closed."""
+
+    def __init__(self, response, release):
+        response.raw.decode_content = True
+        super().__init__(response.raw, buffer_size=1 << 16)
+        self._response = response
+        self._release = release
+
+    def close(self):
+        release, self._release = self._release, None
+        try:
+            super().close()
+            self._response.close()
+        finally:
+            if release:
+                release()
+
+
+class HSCClient:
+    """Shared, thread-safe client for the HSC catalog job API.
+
+    All calls go through one ``requests.Session`` so TCP/TLS connections to
+    the archive are pooled and kept alive between submit, status and download
+    calls. Transient failures are retried with jittered exponential backoff;
+    non-idempotent calls (job submission) are only retried when the
+    connection could not be established, so a job is never submitted twice.
+    With a ``governor``, every attempt first takes a slot on its
+    ``governor_endpoint`` lane in the calling thread's priority class.
+    """
+
+    def __init__(self, base_url=HSC_API_URL, pool_size=HSC_POOL_SIZE, connect_timeout=HSC_CONNECT_TIMEOUT,
+                 read_timeout=HSC_READ_TIMEOUT, max_retries=HSC_MAX_RETRIES, backoff=HSC_RETRY_BACKOFF,
+                 governor=None, governor_endpoint='hsc_api'):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.governor = governor
+        self.governor_endpoint = governor_endpoint
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers['Content-type'] = 'application/json'
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def post(self, endpoint, data, idempotent=True, stream=False):
+        """POST ``data`` as JSON to ``endpoint`` and return the response.
+
+        With ``stream=True`` the body is returned unread as a binary stream
+        that keeps the call's governor slot until it is closed, so a long
+        download counts against its lane for as long as it runs.
+        """
+        data = dict(data, clientVersion=CLIENT_VERSION)
+        body = json.dumps(data).encode('utf-8')
+        url = f"{self.base_url}{endpoint}"
+        attempt = 0
+        while True:
+            with contextlib.ExitStack() as held:
+                held.enter_context(self._slot())
+                start = time.perf_counter()
+                try:
+                    res = self.session.post(url, data=body, timeout=self.timeout, stream=stream)
+                except requests.ConnectTimeout:
+                    # The request never reached the server, so even a submit is safe to resend
+                    self._record(endpoint, time.perf_counter() - start, error=True)
+                    if attempt >= self.max_retries:
+                        raise
+                except (requests.ConnectionError, requests.Timeout):
+                    self._record(endpoint, time.perf_counter() - start, error=True)
+                    if not idempotent or attempt >= self.max_retries:
+                        raise
+                else:
+                    self._record(endpoint, time.perf_counter() - start, error=res.status_code >= 400)
+                    if res.status_code in RETRY_STATUSES and idempotent and attempt < self.max_retries:
+                        res.close()
+                    elif res.status_code >= 400:
+                        raise HSCHTTPError(res.status_code, res.text)
+                    elif stream:
+                        return ResponseStream(res, held.pop_all().close)
+                    else:
+                        return res
+            attempt += 1
+            self._record_retry(endpoint)
+            time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+
+    def _slot(self):
+        return self.governor.slot(self.governor_endpoint) if self.governor else contextlib.nullcontext()
+
+    def post_json(self, endpoint, data, idempotent=True):
+        return self.post(endpoint, data, idempotent=idempotent).json()
+
+    def _record(self, endpoint, seconds, error=False):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {'calls': 0, 'errors': 0, 'retries': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def _record_retry(self, endpoint):
+        with self._lock:
+            self._stats[endpoint]['retries'] += 1
+
+    def connections_opened(self):
+        """Number of TCP connections the pool has had to open (each one a full handshake)."""
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        with self._lock:
+            endpoints = {
+                endpoint: dict(stats, mean_seconds=stats['seconds'] / stats['calls'] if stats['calls'] else 0.0)
+                for endpoint, stats in self._stats.items()
+            }
+        calls = sum(stats['calls'] for stats in endpoints.values())
+        return {
+            'endpoints': endpoints,
+            'calls': calls,
+            'connections_opened': self.connections_opened(),
+            # Calls that reused a kept-alive connection instead of paying a new TCP + TLS handshake
+            'connections_reused': max(calls - self.connections_opened(), 0),
+        }
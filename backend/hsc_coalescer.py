@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+
+
+class LookupCoalescer:
+    """Merges per-key HSC lookups arriving close together into one IN-list job.
+
+    :meth:`lookup` returns a job handle at once. A background thread gathers
+    the keys queued within ``window`` seconds of the first one (up to
+    ``max_keys``), submits a single ``batch_sql(keys)`` job through the job
+    manager and, when it finishes, completes every caller's handle with
+    ``split(result_csv, keys)[key]``. Each per-key result is also written to
+    the query cache under ``single_sql(key)``, exactly as a one-key query
+    would have been, so later lookups of that key never reach HSC.
+    """
+
+    def __init__(self, manager, batch_sql, single_sql, split, kind, window=0.05, max_keys=500):
+        self.manager = manager
+        self.batch_sql = batch_sql
+        self.single_sql = single_sql
+        self.split = split
+        self.kind = kind
+        self.window = window
+        self.max_keys = max_keys
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._cache_hits = 0
+        self._batches = 0
+        self._batch_keys = 0
+        self._thread = threading.Thread(target=self._loop, name=f'{kind}-coalescer', daemon=True)
+        self._thread.start()
+
+    def lookup(self, credential, key):
+        """Job handle for ``key``: finished already on a cache hit, otherwise resolved by the next batch."""
+        with self._lock:
+            self._lookups += 1
+        job = self.manager.cached(self.single_sql(key), self.kind)
+        if job is not None:
+            with self._lock:
+                self._cache_hits += 1
+            return job
+        job = self.manager.track(credential, self.kind, sql=self.single_sql(key))
+        self._queue.put((credential, key, job))
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                'lookups': self._lookups,
+                'cache_hits': self._cache_hits,
+                'batches': self._batches,
+                'mean_keys_per_batch': self._batch_keys / self._batches if self._batches else 0.0,
+                'queue_depth': self._queue.qsize(),
+            }
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(items) < self.max_keys:
+            remaining = deadline - time.perf_counter()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            # Lookups made with different HSC accounts cannot share a job
+            groups = {}
+            for credential, key, job in items:
+                account = credential['account_name'] if credential else None
+                groups.setdefault(account, (credential, {}))[1].setdefault(key, []).append(job)
+            for credential, waiting in groups.values():
+                self._submit(credential, waiting)
+
+    def _submit(self, credential, waiting):
+        keys = list(waiting)
+        with self._lock:
+            self._batches += 1
+            self._batch_keys += len(keys)
+        try:
+            batch = self.manager.submit(credential, self.batch_sql(keys), lambda result_csv: self.split(result_csv, keys),
+                                        kind=f'{self.kind}Batch', cacheable=False)
+        except Exception as e:
+            for jobs in waiting.values():
+                for job in jobs:
+                    self.manager.complete(job, error=str(e))
+            return
+        print(f"LookupCoalescer: Action=Submitted batch, kind={self.kind}, keys={len(keys)}, job_id={batch.id}")
+        self.manager.add_done_callback(batch, lambda batch: self._distribute(batch, waiting))
+
+    def _distribute(self, batch, waiting):
+        for key, jobs in waiting.items():
+            if batch.status == 'error':
+                result, error = None, batch.error
+            else:
+                result, error = batch.result[key], None
+                if self.manager.cache:
+                    self.manager.cache.set(self.single_sql(key), result)
+            for job in jobs:
+                self.manager.complete(job, result=result, error=error)
@@ -0,0 +1,55 @@
+import io
+
+import pandas as pd
+
+
+class HSCCSVError(ValueError):
+    """A CSV input that holds no usable table (empty body or no matching header)."""
+
+
+def find_header(handle, columns):
+    """Read a binary stream up to its header, the first line naming every one of ``columns``, and return its names.
+
+    Blank lines and ``#`` metainfo lines before the header are skipped; the
+    header may itself be commented (``# object_id,ra,...``, as in HSC
+    downloads). The stream is left at the first line after the header.
+    """
+    seen_lines = False
+    for raw_line in iter(handle.readline, b''):
+        line = raw_line.decode('utf-8').replace('\ufeff', '').strip()
+        if not line:
+            continue
+        seen_lines = True
+        names = [name.strip() for name in line.lstrip('#').split(',')]
+        if all(name in names for name in columns):
+            return names
+    if not seen_lines:
+        raise HSCCSVError('No data returned')
+    raise HSCCSVError(f"CSV header naming all of {list(columns)} not found")
+
+
+def read_hsc_csv(source, columns):
+    """Parse an HSC catalog job download into a DataFrame with typed ``columns``.
+
+    ``source`` is a binary stream (such as a streamed HTTP response) or a
+    string. The ``#`` metainfo lines HSC puts before the table are skipped
+    by :func:`find_header`; the rest of the stream is handed straight to the
+    pandas C parser, so the body is never copied into Python strings or
+    per-row dicts. ``columns`` maps each required column to its dtype;
+    missing float values come back as NaN.
+    """
+    if isinstance(source, str):
+        source = io.BytesIO(source.encode('utf-8'))
+    header = find_header(source, columns)
+    return pd.read_csv(
+        source,
+        names=header,
+        header=None,
+        comment='#',
+        usecols=list(columns),
+        dtype=columns,
+        skip_blank_lines=True,
+        skipinitialspace=True,
+        on_bad_lines='skip',
+        encoding='utf-8',
+    )
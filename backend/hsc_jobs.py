@@ -0,0 +1,367 @@
+import heapq
+import itertools
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from outbound import RateLimiter, current_priority, priority
+
+
+# Quoted string literals and identifiers; '' and "" inside them are escaped quotes
+QUOTED_SQL = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+
+def normalize_sql(sql):
+    """``sql`` with whitespace collapsed and case folded outside quotes, so equivalent query texts compare equal.
+
+    Quoted literals and identifiers are kept as written: ``'ABC'`` and
+    ``'abc'`` select different rows, so folding them would hand one query
+    another's result.
+    """
+    parts = QUOTED_SQL.split(sql)
+    return ''.join(part if index % 2 else re.sub(r'\s+', ' ', part).lower() for index, part in enumerate(parts)).strip()
+
+
+def is_permanent_error(error):
+    """Whether a failed status call would fail the same way however often it is repeated.
+
+    A reply that does not parse will not parse next time either, and a 4xx
+    (unknown or expired job id, rejected credentials) stays a 4xx; only
+    throttling (429) is worth waiting out.
+    """
+    status_code = getattr(error, 'status_code', None)
+    return isinstance(error, ValueError) or (status_code is not None and 400 <= status_code < 500 and status_code != 429)
+
+
+class HSCJob:
+    """One submitted HSC catalog job and, once finished, its parsed result."""
+
+    def __init__(self, credential, hsc_job_id, sql, parse, kind, cacheable=True, priority=None):
+        self.id = uuid.uuid4().hex
+        self.credential = credential
+        self.hsc_job_id = hsc_job_id
+        self.sql = sql
+        self.parse = parse
+        self.kind = kind
+        self.cacheable = cacheable
+        # Outbound priority class of this job's polls and download, taken from the submitting thread
+        self.priority = priority or current_priority()
+        self.status = 'running'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.polls = 0
+        self.poll_failures = 0
+        self.cached = False
+        self.last_running = 0.0
+        self.interval = None
+        self.done_event = threading.Event()
+        self.callbacks = []
+
+    def describe(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'hsc_job_id': self.hsc_job_id,
+            'polls': self.polls,
+            'priority': self.priority,
+            'cached': self.cached,
+            'elapsed': (self.finished or time.time()) - self.created,
+            'error': self.error,
+        }
+
+
+class PollPlanner:
+    """Chooses when to next poll a job from the completion times seen for its kind.
+
+    With fewer than ``min_samples`` finished jobs of a kind it falls back to
+    doubling the interval. Once it has history, the next poll is placed just
+    after the next completion-time quantile the job has not yet passed, so a
+    job that usually takes 1.1 s is checked at ~1.2 s rather than at 3 s,
+    while a job past the slowest observed time backs off by doubling.
+    """
+
+    QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.95)
+
+    def __init__(self, first_interval=1, min_interval=0.25, max_interval=300, history=200, min_samples=5,
+                 jitter=0.1):
+        self.first_interval = first_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_samples = min_samples
+        self.jitter = jitter
+        self._history_size = history
+        self._history = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self._history.setdefault(kind, deque(maxlen=self._history_size)).append(seconds)
+
+    def _quantiles(self, kind):
+        with self._lock:
+            durations = sorted(self._history.get(kind, ()))
+        if len(durations) < self.min_samples:
+            return None
+        return [durations[min(int(q * len(durations)), len(durations) - 1)] for q in self.QUANTILES]
+
+    def next_delay(self, job, elapsed):
+        """Seconds until ``job`` (``elapsed`` seconds old) should be polled again."""
+        quantiles = self._quantiles(job.kind)
+        upcoming = [q for q in quantiles or () if q > elapsed + self.min_interval]
+        if upcoming:
+            delay = upcoming[0] - elapsed
+        elif job.interval is None:
+            delay = quantiles[0] if quantiles else self.first_interval
+        else:
+            delay = job.interval * 2
+        delay = min(max(delay, self.min_interval), self.max_interval)
+        job.interval = delay
+        # Jitter so jobs submitted together do not poll in lockstep
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def stats(self):
+        with self._lock:
+            history = {kind: list(durations) for kind, durations in self._history.items()}
+        return {
+            kind: {'samples': len(durations), 'median_seconds': statistics.median(durations)}
+            for kind, durations in history.items() if durations
+        }
+
+
+class HSCJobManager:
+    """Tracks outstanding HSC jobs and polls them all from one background scheduler.
+
+    Request handlers call :meth:`submit`, which sends the job to HSC and
+    returns immediately, then optionally :meth:`wait` on the job's event.
+    The scheduler thread is the only place that decides when HSC is polled:
+    poll times come from a :class:`PollPlanner`, and every status call takes
+    a token from a shared :class:`RateLimiter` so many outstanding jobs never
+    exceed ``status_rate`` calls per second. Status calls and downloads run
+    on small worker pools so a slow response never delays other jobs.
+    Finished jobs are kept for ``result_ttl`` seconds so clients can fetch
+    their results by id. With a ``cache``, a query whose SQL was answered
+    before is returned already finished and never reaches HSC.
+
+    Jobs created with :meth:`track` have no HSC job of their own; whoever
+    created them resolves them with :meth:`complete`, which lets several
+    callers share one HSC query while each keeps its own job id.
+
+    Submissions are single-flight: while a job for some normalized SQL is
+    outstanding, submitting the same SQL again returns that job instead of
+    starting a duplicate one on HSC.
+
+    A job whose status call fails permanently, or fails ``max_poll_failures``
+    times in a row, is finished with an error rather than polled forever.
+    """
+
+    def __init__(self, submit_fn, status_fn, download_fn, first_interval=1, max_interval=300,
+                 result_ttl=600, download_workers=4, status_rate=5, poll_workers=4, cache=None, max_poll_failures=5):
+        self.submit_fn = submit_fn
+        self.status_fn = status_fn
+        self.download_fn = download_fn
+        self.result_ttl = result_ttl
+        self.cache = cache
+        self.max_poll_failures = max_poll_failures
+        self.planner = PollPlanner(first_interval=first_interval, max_interval=max_interval)
+        self.limiter = RateLimiter(status_rate)
+        self.status_calls = 0
+        self.deduplicated = 0
+        self._jobs = {}
+        self._inflight = {}
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._polls = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix='hsc-poll')
+        self._downloads = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='hsc-download')
+        self._thread = threading.Thread(target=self._loop, name='hsc-job-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, credential, sql, parse, kind='query', cacheable=True):
+        """Submit ``sql`` to HSC and return its job handle without waiting for it.
+
+        ``cacheable=False`` keeps the parsed result out of the query cache, for
+        jobs whose ``parse`` does not return a ``(payload, status)`` pair.
+        """
+        cached = self.cached(sql, kind) if cacheable else None
+        if cached is not None:
+            return cached
+        key = normalize_sql(sql)
+        with self._condition:
+            job = self._inflight.get(key)
+            if job is not None:
+                self.deduplicated += 1
+                print(f"HSCJobManager: Action=Attached to in-flight job, job_id={job.id}, kind={kind}")
+                return job
+            # Registered before the submit call so identical requests arriving meanwhile attach to it
+            job = HSCJob(credential, None, sql, parse, kind, cacheable=cacheable)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+        try:
+            hsc_job = self.submit_fn(credential, sql, out_format='csv')
+        except Exception as e:
+            self._finish(job, error=str(e))
+            raise
+        job.hsc_job_id = hsc_job['id']
+        print(f"HSCJobManager: Action=Submitted job, job_id={job.id}, hsc_job_id={job.hsc_job_id}, kind={kind}")
+        with self._condition:
+            self._push(job, time.time() + self.planner.next_delay(job, 0.0))
+        return job
+
+    def cached(self, sql, kind='query'):
+        """An already-finished job holding the cached result for ``sql``, or None on a cache miss."""
+        result = self.cache.get(sql) if self.cache else None
+        if result is None:
+            return None
+        job = self.track(None, kind, sql=sql)
+        job.cached = True
+        self.complete(job, result=result)
+        return job
+
+    def track(self, credential, kind, sql=None):
+        """Register a running job that will be resolved by :meth:`complete` rather than by polling HSC."""
+        job = HSCJob(credential, None, sql, None, kind)
+        with self._condition:
+            self._jobs[job.id] = job
+        return job
+
+    def complete(self, job, result=None, error=None):
+        self._finish(job, result=result, error=error)
+
+    def add_done_callback(self, job, fn):
+        """Call ``fn(job)`` once ``job`` has finished (straight away if it already has)."""
+        with self._condition:
+            if not job.finished:
+                job.callbacks.append(fn)
+                return
+        fn(job)
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout):
+        """Block the caller on the job's event (not on HSC) for up to ``timeout`` seconds."""
+        if timeout and timeout > 0:
+            job.done_event.wait(timeout)
+        return job
+
+    def stats(self):
+        with self._condition:
+            jobs = list(self._jobs.values())
+            queued = len(self._schedule)
+        finished = [job for job in jobs if job.finished]
+        return {
+            'running': sum(job.status == 'running' for job in jobs),
+            'done': sum(job.status == 'done' for job in jobs),
+            'error': sum(job.status == 'error' for job in jobs),
+            'scheduled_polls': queued,
+            'status_calls': self.status_calls,
+            'deduplicated_submissions': self.deduplicated,
+            'mean_polls_per_job': sum(job.polls for job in finished) / len(finished) if finished else 0.0,
+            'completion_times': self.planner.stats(),
+        }
+
+    def _push(self, job, due):
+        heapq.heappush(self._schedule, (due, next(self._sequence), job))
+        self._condition.notify()
+
+    def _next_due(self):
+        """Pop the next job whose poll is due and within the rate limit, sleeping on the condition until then."""
+        with self._condition:
+            while True:
+                self._expire()
+                if not self._schedule:
+                    self._condition.wait(timeout=self.result_ttl)
+                    continue
+                due, _, job = self._schedule[0]
+                delay = due - time.time()
+                if delay <= 0:
+                    delay = self.limiter.take()
+                    if delay <= 0:
+                        heapq.heappop(self._schedule)
+                        return job
+                self._condition.wait(timeout=delay)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _loop(self):
+        while True:
+            self._polls.submit(self._poll, self._next_due())
+
+    def _poll(self, job):
+        error = None
+        try:
+            with priority(job.priority):
+                status = self.status_fn(job.credential, job.hsc_job_id)
+            if not isinstance(status, dict):
+                raise ValueError(f"Unexpected status reply {status!r:.200}")
+        except Exception as e:
+            error = e
+        with self._condition:
+            self.status_calls += 1
+        job.polls += 1
+        elapsed = time.time() - job.created
+        if error is not None:
+            job.poll_failures += 1
+            if is_permanent_error(error) or job.poll_failures >= self.max_poll_failures:
+                self._finish(job, error=f"Status poll failed: {str(error)}")
+                return
+            # Transient failures were already retried by the client; try again on the next interval
+            print(f"HSCJobManager: Warning: status poll failed for job_id={job.id}, failures={job.poll_failures}: {str(error)}")
+            status = {'status': 'running'}
+        else:
+            job.poll_failures = 0
+        if status.get('status') == 'error':
+            self._finish(job, error=f"Query error: {status.get('error', 'Unknown error')}")
+        elif status.get('status') == 'done':
+            # The job finished somewhere between the last 'running' answer and this one
+            self.planner.record(job.kind, (job.last_running + elapsed) / 2)
+            self._downloads.submit(self._download, job)
+        else:
+            job.last_running = elapsed
+            with self._condition:
+                self._push(job, time.time() + self.planner.next_delay(job, elapsed))
+
+    def _download(self, job):
+        try:
+            with priority(job.priority):
+                download = self.download_fn(job.credential, job.hsc_job_id)
+            try:
+                result = job.parse(download)
+            finally:
+                # Streamed downloads hold a pooled connection until closed
+                if hasattr(download, 'close'):
+                    download.close()
+            if self.cache and job.cacheable:
+                self.cache.set(job.sql, result)
+            self._finish(job, result=result)
+        except Exception as e:
+            self._finish(job, error=str(e))
+
+    def _finish(self, job, result=None, error=None):
+        with self._condition:
+            job.result = result
+            job.error = error
+            job.status = 'error' if error else 'done'
+            job.finished = time.time()
+            callbacks, job.callbacks = job.callbacks, []
+            if job.sql is not None and self._inflight.get(normalize_sql(job.sql)) is job:
+                del self._inflight[normalize_sql(job.sql)]
+        print(f"HSCJobManager: Action=Job {job.status}, job_id={job.id}, seconds={job.finished - job.created:.1f}")
+        job.done_event.set()
+        for fn in callbacks:
+            try:
+                fn(job)
+            except Exception as e:
+                print(f"HSCJobManager: Warning: done callback failed for job_id={job.id}: {str(e)}")
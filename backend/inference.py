@@ -1,11 +1,126 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 import numpy as np
-import onnxruntime as ort
+import os
+import atexit
+import threading
+import time
+from batching import MicroBatcher
+from bulk_job import BulkJobManager, CHUNK_ROWS, ID_COLUMN
+from functools import partial
+from model_session import build_session, normalize, warm_up, model_hash
+from prediction_cache import PredictionCache
+from worker_pool import WorkerPool
+from tensor_io import BINARY_TYPES, JSON, NPY, OCTET_STREAM, decode_tensor, encode_tensor, media_type
 
-# Load ONNX model
-session = ort.InferenceSession(r"main_network.onnx", providers=["CPUExecutionProvider"])
+MODEL_PATH = os.getenv("INFERENCE_MODEL_PATH", "main_network.onnx")
+INT8_MODEL_PATH = os.getenv("INFERENCE_INT8_MODEL_PATH", "main_network.int8.onnx")
+
+# Precision variants served side by side; missing files are skipped at start-up
+MODEL_VARIANTS = {
+    "fp32": MODEL_PATH,
+    "int8": INT8_MODEL_PATH,
+}
+DEFAULT_MODEL = os.getenv("INFERENCE_DEFAULT_MODEL", "fp32")
+
+# Rows per session.run call for /predict_batch
+BATCH_CHUNK_SIZE = int(os.getenv("INFERENCE_BATCH_CHUNK_SIZE", "1024"))
+
+# Opt-in micro-batching of concurrent /predict requests
+MICROBATCH_ENABLED = os.getenv("INFERENCE_MICROBATCH", "0") == "1"
+MICROBATCH_MAX_SIZE = int(os.getenv("INFERENCE_MICROBATCH_MAX_SIZE", "64"))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("INFERENCE_MICROBATCH_MAX_WAIT_MS", "2"))
+
+# Multi-process serving: N worker processes, each with its own session on a slice of cores
+WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+WORKER_SLOTS = int(os.getenv("INFERENCE_WORKER_SLOTS", "4"))
+WORKER_SLOT_ROWS = int(os.getenv("INFERENCE_WORKER_SLOT_ROWS", "1024"))
+
+# Bulk photo-z jobs: state and outputs under JOBS_DIR, local inputs must live under JOB_DATA_DIR
+JOBS_DIR = os.getenv("INFERENCE_JOBS_DIR", "jobs")
+JOB_DATA_DIR = os.getenv("INFERENCE_JOB_DATA_DIR", "data")
+JOB_CONCURRENCY = int(os.getenv("INFERENCE_JOB_CONCURRENCY", "1"))
+JOB_INPUT_EXTENSIONS = (".csv", ".parquet", ".pq")
+
+# Per-row prediction cache in front of session.run; 0 disables it
+CACHE_SIZE = int(os.getenv("INFERENCE_CACHE_SIZE", "100000"))
+# Seconds between checks of the model files for changes
+MODEL_CHECK_INTERVAL = float(os.getenv("INFERENCE_MODEL_CHECK_INTERVAL", "5"))
+
+sessions = {}
+model_hashes = {}
+model_signatures = {}
+reload_lock = threading.Lock()
+last_model_check = time.monotonic()
+cache = PredictionCache(CACHE_SIZE) if CACHE_SIZE > 0 else None
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_variant(name):
+    """Build, warm up and publish the session for one model variant."""
+    path = MODEL_VARIANTS[name]
+    signature = file_signature(path)
+    digest = model_hash(path)
+    variant_session = build_session(path, digest=digest)
+    warm_up(variant_session)
+    # Publish the session before its hash so a cache key never pairs a new hash with the old session
+    sessions[name] = variant_session
+    model_hashes[name] = digest
+    model_signatures[name] = signature
+
+
+def check_model_files():
+    """Reload variants whose file changed on disk and drop their cached predictions."""
+    global last_model_check
+    now = time.monotonic()
+    if now - last_model_check < MODEL_CHECK_INTERVAL or not reload_lock.acquire(blocking=False):
+        return
+    try:
+        last_model_check = now
+        for name in list(sessions):
+            try:
+                signature = file_signature(MODEL_VARIANTS[name])
+            except FileNotFoundError:
+                continue
+            if signature == model_signatures[name]:
+                continue
+            previous_hash = model_hashes[name]
+            print(f"check_model_files: Action=Reloading changed model, name={name}")
+            load_variant(name)
+            if cache and model_hashes[name] != previous_hash:
+                cache.clear()
+    finally:
+        reload_lock.release()
+
+
+# Load every available model variant and warm it up before the app starts serving
+for name, path in MODEL_VARIANTS.items():
+    if not os.path.exists(path):
+        print(f"inference: Action=Skipping model variant, name={name}, missing={path}")
+        continue
+    load_variant(name)
+if DEFAULT_MODEL not in sessions:
+    raise RuntimeError(f"Default model variant {DEFAULT_MODEL!r} is not available, loaded {list(sessions)}")
+
+pool = None
+if WORKERS > 0:
+    pool = WorkerPool(
+        {name: MODEL_VARIANTS[name] for name in sessions},
+        model_hashes,
+        features=sessions[DEFAULT_MODEL].get_inputs()[0].shape[1],
+        workers=WORKERS,
+        slots=WORKER_SLOTS,
+        slot_rows=WORKER_SLOT_ROWS,
+    )
+    atexit.register(pool.close)
+ready = True
 
 # Define FastAPI app
 app = FastAPI()
@@ -22,19 +137,243 @@ app.add_middleware(
 # Define input format
 class InputData(BaseModel):
     data: list  # expecting a list of floats
+    model: str | None = None  # precision variant, e.g. "fp32" or "int8"
+
+
+class BatchInputData(BaseModel):
+    data: list  # expecting a list of rows, each a list of floats
+    chunk_size: int | None = None
+    model: str | None = None
+
+
+class BulkJobInput(BaseModel):
+    input_path: str  # relative to INFERENCE_JOB_DATA_DIR
+    chunk_rows: int = CHUNK_ROWS
+    feature_columns: list[str] | None = None
+    id_column: str | None = ID_COLUMN
+    model: str | None = None
+
+
+def resolve_model(model):
+    """Map a request's model field to a loaded variant name."""
+    model = model or DEFAULT_MODEL
+    if model not in sessions:
+        raise HTTPException(status_code=400, detail=f"Unknown model {model!r}, available: {list(sessions)}")
+    return model
+
+
+def input_matrix(data, model, single_row=False):
+    """Request rows as an (N, F) float32 array, or a 400 if they are ragged or not the model's width."""
+    try:
+        array = np.asarray(data, dtype=np.float32)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="data must hold rows of numbers of equal length")
+    if single_row:
+        array = array.reshape(1, -1)
+    if array.ndim != 2:
+        raise HTTPException(status_code=400, detail="data must be an (N, F) matrix")
+    features = sessions[model].get_inputs()[0].shape[1]
+    if array.shape[1] != features:
+        raise HTTPException(status_code=400, detail=f"each row must have {features} features, got {array.shape[1]}")
+    return array
+
+
+def body_reader(schema):
+    """Dependency parsing a JSON body with ``schema`` or a binary float32 tensor.
+
+    Binary bodies (raw float32 or .npy) skip pydantic entirely; ``model`` and
+    ``chunk_size`` then come from the query string.
+    """
+    async def read_body(request: Request, model: str | None = None, chunk_size: int | None = None):
+        content_type = media_type(request.headers.get("content-type")) or JSON
+        body = await request.body()
+        if content_type not in BINARY_TYPES:
+            try:
+                return schema.model_validate_json(body)
+            except ValidationError as e:
+                raise RequestValidationError(e.errors(include_url=False))
+        features = sessions[resolve_model(model)].get_inputs()[0].shape[1] if schema is BatchInputData else None
+        try:
+            data = decode_tensor(body, content_type, features)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        fields = {"data": data, "model": model}
+        if "chunk_size" in schema.model_fields:
+            fields["chunk_size"] = chunk_size
+        return schema.model_construct(**fields)
+
+    return read_body
+
+
+def tensor_response(request, output, key):
+    """Return ``output`` in the Accept format, else mirroring the request body format."""
+    accept = media_type(request.headers.get("accept"))
+    content_type = media_type(request.headers.get("content-type"))
+    if accept in BINARY_TYPES or accept == JSON:
+        response_type = accept
+    else:
+        response_type = content_type if content_type in BINARY_TYPES else JSON
+    if response_type == JSON:
+        return {key: output.tolist()}
+    return Response(
+        content=encode_tensor(output, response_type),
+        media_type=response_type,
+        headers={"X-Tensor-Shape": ",".join(map(str, output.shape))},
+    )
+
 
+def openapi_body(schema):
+    """Document the JSON schema alongside the binary tensor content types."""
+    binary = {"schema": {"type": "string", "format": "binary"}}
+    return {"requestBody": {"required": True, "content": {
+        JSON: {"schema": schema.model_json_schema()},
+        OCTET_STREAM: binary,
+        NPY: binary,
+    }}}
 
-@app.post("/predict")
-def predict(input_data: InputData):
-    # Convert input to NumPy array
-    input_array = np.array(input_data.data, dtype=np.float32).reshape(1, -1)
-    # Normalize input data
-    input_array = (input_array - np.mean(input_array)) / (np.std(input_array) + 1e-8)
-    # Run inference
-    output = session.run(None, {"input": input_array})
+
+def run_batch(batch, chunk_size=None, model=None):
+    """Normalize an (N, F) array and run it through a model variant chunk by chunk."""
+    model = model or DEFAULT_MODEL
+    if pool:
+        # Workers normalize and chunk by their slot size themselves
+        return pool.run(np.asarray(batch, dtype=np.float32), model, model_hashes[model])
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    variant_session = sessions[model]
+    batch = normalize(batch)
+    outputs = [
+        variant_session.run(["output"], {"input": batch[start:start + chunk_size]})[0]
+        for start in range(0, len(batch), chunk_size)
+    ]
+    return np.concatenate(outputs) if outputs else np.empty((0, 1), dtype=np.float32)
+
+
+def predict_rows(batch, chunk_size=None, model=None, runner=None):
+    """Serve rows from the prediction cache and run only the misses through ``runner``."""
+    model = model or DEFAULT_MODEL
+    runner = runner or partial(run_batch, chunk_size=chunk_size, model=model)
+    if cache is None or len(batch) == 0:
+        return runner(batch)
+    keys = cache.keys(batch, model_hashes[model])
+    rows = cache.get_many(keys)
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        computed = runner(batch[missing])
+        cache.put_many([keys[i] for i in missing], computed)
+        for i, row in zip(missing, computed):
+            rows[i] = row
+    return np.stack(rows)
+
+
+batchers = {
+    name: MicroBatcher(partial(run_batch, model=name), MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_MS / 1000)
+    for name in sessions
+} if MICROBATCH_ENABLED else {}
+
+
+@app.post("/predict", openapi_extra=openapi_body(InputData))
+def predict(request: Request, input_data: InputData = Depends(body_reader(InputData))):
+    check_model_files()
+    model = resolve_model(input_data.model)
+    # Convert input to NumPy array (binary bodies are already float32 views)
+    input_array = input_matrix(input_data.data, model, single_row=True)
+    # Normalize input data and run inference, skipping rows already in the cache
+    output = predict_rows(input_array, model=model, runner=batchers[model].submit if batchers else None)
 
     # Return output
-    return {"prediction": output[0].tolist()}
+    return tensor_response(request, output, "prediction")
+
+
+@app.post("/predict_batch", openapi_extra=openapi_body(BatchInputData))
+def predict_batch(request: Request, input_data: BatchInputData = Depends(body_reader(BatchInputData))):
+    check_model_files()
+    model = resolve_model(input_data.model)
+    input_array = input_matrix(input_data.data, model)
+    if input_data.chunk_size is not None and input_data.chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+    output = predict_rows(input_array, input_data.chunk_size, model)
+    return tensor_response(request, output, "predictions")
+
+
+# Bulk jobs score through run_batch directly; millions of unique rows would only churn the cache
+jobs = BulkJobManager(JOBS_DIR, lambda batch, model: run_batch(batch, model=model), JOB_CONCURRENCY)
+
+
+def job_or_404(job_id):
+    state = jobs.status(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return state
+
+
+@app.post("/jobs")
+def create_job(job: BulkJobInput):
+    data_dir = os.path.realpath(JOB_DATA_DIR)
+    input_path = os.path.realpath(os.path.join(data_dir, job.input_path))
+    if os.path.commonpath([data_dir, input_path]) != data_dir or not input_path.endswith(JOB_INPUT_EXTENSIONS):
+        raise HTTPException(status_code=400, detail=f"input_path must be a CSV/Parquet file under {JOB_DATA_DIR}")
+    if not os.path.exists(input_path):
+        raise HTTPException(status_code=404, detail=f"{job.input_path} not found")
+    if job.chunk_rows < 1:
+        raise HTTPException(status_code=400, detail="chunk_rows must be positive")
+    model = resolve_model(job.model)
+    return jobs.submit(input_path, chunk_rows=job.chunk_rows, feature_columns=job.feature_columns, id_column=job.id_column, model=model)
+
+
+@app.post("/jobs/upload")
+async def upload_job(request: Request, filename: str = "input.csv", chunk_rows: int = CHUNK_ROWS, id_column: str = ID_COLUMN, model: str | None = None):
+    """Stream the raw request body to disk and start a bulk job on it."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in JOB_INPUT_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"filename must end in one of {JOB_INPUT_EXTENSIONS}")
+    if chunk_rows < 1:
+        raise HTTPException(status_code=400, detail="chunk_rows must be positive")
+    model = resolve_model(model)
+    job_id = jobs.new_job_id()
+    os.makedirs(jobs.job_dir(job_id), exist_ok=True)
+    input_path = os.path.join(jobs.job_dir(job_id), f"input{extension}")
+    with open(input_path, "wb") as f:
+        async for block in request.stream():
+            f.write(block)
+    return jobs.submit(input_path, job_id=job_id, chunk_rows=chunk_rows, id_column=id_column or None, model=model)
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return job_or_404(job_id)
+
+
+@app.post("/jobs/{job_id}/resume")
+def resume_job(job_id: str):
+    job_or_404(job_id)
+    return jobs.resume(job_id)
+
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    state = job_or_404(job_id)
+    if not os.path.exists(state["output_path"]):
+        raise HTTPException(status_code=404, detail="Job has not written any output yet")
+    # Partial output of a running job is served as-is up to the last checkpoint
+    return FileResponse(state["output_path"], media_type="text/csv", filename=f"{job_id}.csv")
+
+
+@app.get("/health")
+def health():
+    return {
+        "ready": ready,
+        "default_model": DEFAULT_MODEL,
+        "models": {name: {"path": MODEL_VARIANTS[name], "hash": model_hashes[name]} for name in sessions},
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "batching": {name: batcher.stats() for name, batcher in batchers.items()} or None,
+        "cache": cache.stats() if cache else None,
+        "workers": pool.stats() if pool else None,
+    }
 
 
 if __name__ == "__main__":
@@ -44,3 +383,8 @@ if __name__ == "__main__":
     payload = {"data": [0.1, 0.2, 0.3, 0.4, 0.5]}
     response = requests.post(url, json=payload)
     print(response.json())
+
+    url = "http://localhost:8000/predict_batch"
+    payload = {"data": [[0.1, 0.2, 0.3, 0.4, 0.5], [0.5, 0.4, 0.3, 0.2, 0.1]]}
+    response = requests.post(url, json=payload)
+    print(response.json())
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import onnxruntime as ort
+
+# ONNX Runtime session configuration; 0 threads means "let ORT decide"
+INTRA_OP_THREADS = int(os.getenv("INFERENCE_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.getenv("INFERENCE_INTER_OP_THREADS", "0"))
+EXECUTION_MODE = os.getenv("INFERENCE_EXECUTION_MODE", "sequential")
+GRAPH_OPT_LEVEL = os.getenv("INFERENCE_GRAPH_OPT_LEVEL", "all")
+# Directory holding pre-optimized graphs; empty disables the cache
+MODEL_CACHE_DIR = os.getenv("INFERENCE_MODEL_CACHE_DIR", "model_cache")
+WARMUP_ROWS = int(os.getenv("INFERENCE_WARMUP_ROWS", "64"))
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+PROVIDERS = ["CPUExecutionProvider"]
+
+
+def model_hash(model_path):
+    """SHA-256 of the model file, used to key the optimized graph cache."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def session_options(intra_op_threads=None, inter_op_threads=None):
+    """Build SessionOptions from the INFERENCE_* environment settings."""
+    if EXECUTION_MODE not in EXECUTION_MODES:
+        raise ValueError(f"Unknown INFERENCE_EXECUTION_MODE {EXECUTION_MODE!r}, expected one of {list(EXECUTION_MODES)}")
+    if GRAPH_OPT_LEVEL not in GRAPH_OPT_LEVELS:
+        raise ValueError(f"Unknown INFERENCE_GRAPH_OPT_LEVEL {GRAPH_OPT_LEVEL!r}, expected one of {list(GRAPH_OPT_LEVELS)}")
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    options.inter_op_num_threads = INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    options.execution_mode = EXECUTION_MODES[EXECUTION_MODE]
+    options.graph_optimization_level = GRAPH_OPT_LEVELS[GRAPH_OPT_LEVEL]
+    return options
+
+
+def cached_model_path(model_path, digest):
+    """Location of the optimized graph for a model hash and optimization level."""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(MODEL_CACHE_DIR, f"{stem}-{digest[:16]}-{GRAPH_OPT_LEVEL}.onnx")
+
+
+def build_session(model_path, intra_op_threads=None, inter_op_threads=None, digest=None):
+    """Create an InferenceSession, loading or writing the optimized graph cache."""
+    options = session_options(intra_op_threads, inter_op_threads)
+    if not MODEL_CACHE_DIR or GRAPH_OPT_LEVEL == "disable":
+        return ort.InferenceSession(model_path, options, providers=PROVIDERS)
+
+    cached_path = cached_model_path(model_path, digest or model_hash(model_path))
+    if os.path.exists(cached_path):
+        print(f"build_session: Action=Loading optimized graph, path={cached_path}")
+        # The cached graph is already optimized, so skip re-running the optimizers
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return ort.InferenceSession(cached_path, options, providers=PROVIDERS)
+
+    print(f"build_session: Action=Optimizing graph, model={model_path}, cache={cached_path}")
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    # Write to a per-process temp file and rename so concurrent workers never see a partial graph
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = tmp_path
+    session = ort.InferenceSession(model_path, options, providers=PROVIDERS)
+    os.replace(tmp_path, cached_path)
+    return session
+
+
+def normalize(batch):
+    """Normalize every row of an (N, F) array by its own mean and std."""
+    mean = np.mean(batch, axis=1, keepdims=True)
+    std = np.std(batch, axis=1, keepdims=True)
+    return (batch - mean) / (std + 1e-8)
+
+
+def warm_up(session, rows=None):
+    """Run a throwaway batch so the first real request does not pay allocation costs."""
+    rows = rows or WARMUP_ROWS
+    model_input = session.get_inputs()[0]
+    features = model_input.shape[1]
+    start = time.perf_counter()
+    for batch_size in (1, rows):
+        session.run(None, {model_input.name: np.zeros((batch_size, features), dtype=np.float32)})
+    print(f"warm_up: Action=Warmed up session, seconds={time.perf_counter() - start:.4f}")
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Priority classes, most urgent first; a waiting request of an earlier class always goes before a later one
+PRIORITY_CLASSES = ('interactive', 'background')
+DEFAULT_PRIORITY = 'interactive'
+
+_local = threading.local()
+
+
+def current_priority():
+    """Priority class of outbound calls made by this thread."""
+    return getattr(_local, 'priority', DEFAULT_PRIORITY)
+
+
+@contextmanager
+def priority(name):
+    """Run the enclosed outbound calls of this thread in priority class ``name``."""
+    if name not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority {name!r}, expected one of {list(PRIORITY_CLASSES)}")
+    previous = current_priority()
+    _local.priority = name
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class RateLimiter:
+    """Token bucket capping outbound calls per second across every caller."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Consume a token and return 0, or return the seconds until one is available."""
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class _Lane:
+    """Admission state for one remote endpoint."""
+
+    def __init__(self, max_concurrent, rate):
+        self.max_concurrent = max_concurrent
+        self.limiter = RateLimiter(rate)
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.in_flight = 0
+        self.waits = {name: deque(maxlen=1000) for name in PRIORITY_CLASSES}
+        self.admitted = {name: 0 for name in PRIORITY_CLASSES}
+
+
+class OutboundGovernor:
+    """Shared admission control for calls to the HSC archive.
+
+    Each endpoint gets a lane with at most ``max_concurrent`` calls in flight
+    and a token bucket of ``rate`` calls per second (0 for no rate cap).
+    Callers wait in a priority queue per lane: interactive requests are
+    always admitted before background ones, and callers of the same class
+    go in arrival order. Time spent queued is recorded per class.
+    """
+
+    def __init__(self, limits):
+        self._lanes = {endpoint: _Lane(max_concurrent, rate) for endpoint, (max_concurrent, rate) in limits.items()}
+        self._sequence = itertools.count()
+
+    @contextmanager
+    def slot(self, endpoint, priority=None):
+        """Hold one of ``endpoint``'s slots for the enclosed call; endpoints without a lane are not limited."""
+        lane = self._lanes.get(endpoint)
+        if lane is None:
+            yield
+            return
+        self._acquire(lane, priority or current_priority())
+        try:
+            yield
+        finally:
+            with lane.condition:
+                lane.in_flight -= 1
+                lane.condition.notify_all()
+
+    def _acquire(self, lane, priority):
+        ticket = (PRIORITY_CLASSES.index(priority), next(self._sequence))
+        start = time.perf_counter()
+        with lane.condition:
+            heapq.heappush(lane.waiting, ticket)
+            while True:
+                if lane.waiting[0] == ticket and lane.in_flight < lane.max_concurrent:
+                    delay = lane.limiter.take()
+                    if delay <= 0:
+                        break
+                    lane.condition.wait(timeout=delay)
+                else:
+                    lane.condition.wait()
+            heapq.heappop(lane.waiting)
+            lane.in_flight += 1
+            lane.waits[priority].append(time.perf_counter() - start)
+            lane.admitted[priority] += 1
+            # The next caller in line may be admissible too
+            lane.condition.notify_all()
+
+    def stats(self):
+        stats = {}
+        for endpoint, lane in self._lanes.items():
+            with lane.condition:
+                classes = {}
+                for name, waits in lane.waits.items():
+                    ordered = sorted(waits)
+                    classes[name] = {
+                        'admitted': lane.admitted[name],
+                        'mean_wait_seconds': sum(ordered) / len(ordered) if ordered else 0.0,
+                        'p95_wait_seconds': ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0,
+                        'max_wait_seconds': ordered[-1] if ordered else 0.0,
+                    }
+                stats[endpoint] = {
+                    'max_concurrent': lane.max_concurrent,
+                    'rate': lane.limiter.rate,
+                    'in_flight': lane.in_flight,
+                    'queued': len(lane.waiting),
+                    'classes': classes,
+                }
+        return stats
@@ -0,0 +1,57 @@
+import threading
+
+import numpy as np
+from astropy.cosmology import Planck18
+
+from model_session import build_session, normalize, warm_up
+
+# Magnitude columns fed to the network, in input order
+BANDS = ('g_cmodel_mag', 'r_cmodel_mag', 'i_cmodel_mag', 'z_cmodel_mag', 'y_cmodel_mag')
+
+
+class PhotoZModel:
+    """Photometric-redshift network run in-process on whole batches of galaxies.
+
+    The ONNX session is built on first use (through the same optimized graph
+    cache as the inference service) so the web app starts without paying for
+    it. Rows are normalized exactly as the inference service does before
+    one ``session.run`` over the batch.
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = build_session(self.model_path)
+                warm_up(self._session)
+            return self._session
+
+    def predict(self, features):
+        """Redshift for each row of an (N, 5) g/r/i/z/y magnitude matrix."""
+        features = np.asarray(features, dtype=np.float32)
+        if len(features) == 0:
+            return np.empty(0, dtype=np.float32)
+        output = self.session().run(['output'], {'input': normalize(features)})[0]
+        return output.reshape(len(features), -1)[:, 0]
+
+
+# Redshift grid for comoving distances; interpolating it replaces one numerical integral per galaxy
+DISTANCE_GRID_MAX_Z = 10.0
+DISTANCE_GRID_POINTS = 4001
+_distance_grid = None
+
+
+def comoving_distance(redshift):
+    """Planck18 comoving distance in Mpc for an array of redshifts (NaN where z is missing or out of range)."""
+    global _distance_grid
+    if _distance_grid is None:
+        z = np.linspace(0.0, DISTANCE_GRID_MAX_Z, DISTANCE_GRID_POINTS)
+        _distance_grid = (z, Planck18.comoving_distance(z).to_value('Mpc'))
+    grid_z, grid_distance = _distance_grid
+    redshift = np.asarray(redshift, dtype=np.float64)
+    valid = np.isfinite(redshift) & (redshift >= 0) & (redshift <= DISTANCE_GRID_MAX_Z)
+    return np.where(valid, np.interp(np.where(valid, redshift, 0.0), grid_z, grid_distance), np.nan)
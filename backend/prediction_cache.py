@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """In-process LRU of per-row predictions.
+
+    Keys are a BLAKE2 digest of the row's raw float32 bytes combined with the
+    model hash, so a new model never serves predictions made by an old one.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def keys(batch, model_version):
+        """One key per row of an (N, F) array."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        prefix = model_version.encode()
+        return [hashlib.blake2b(prefix + row.tobytes(), digest_size=16).digest() for row in batch]
+
+    def get_many(self, keys):
+        """Cached output rows for ``keys`` (None where missing), refreshing their recency."""
+        found = []
+        with self._lock:
+            for key in keys:
+                row = self._entries.get(key)
+                if row is not None:
+                    self._entries.move_to_end(key)
+                found.append(row)
+            hit_count = sum(row is not None for row in found)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return found
+
+    def put_many(self, keys, rows):
+        with self._lock:
+            for key, row in zip(keys, rows):
+                self._entries[key] = row.copy()
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,140 @@
+"""Produce the INT8 variant of main_network.onnx and compare it against FP32.
+
+Run offline from the backend directory (needs the ``onnx`` package, which
+``onnxruntime.quantization`` imports)::
+
+    python quantize_model.py
+    python quantize_model.py --reference magnitudes.npy --report reports/quantization.md
+
+The reference set is an (N, 5) array of g/r/i/z/y cmodel magnitudes in a
+``.npy`` or ``.csv`` file. Without one, a seeded synthetic set of HSC-like
+magnitudes is used so the report is reproducible.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from model_session import build_session, normalize, warm_up
+
+FP32_MODEL_PATH = "main_network.onnx"
+INT8_MODEL_PATH = "main_network.int8.onnx"
+
+
+def quantize(src, dst):
+    """Dynamic-quantize the Gemm/MatMul weights of ``src`` to INT8."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    print(f"quantize: Action=Wrote INT8 model, path={dst}, bytes={os.path.getsize(dst)}")
+
+
+def synthetic_reference(rows=20000, seed=0):
+    """HSC-like g/r/i/z/y magnitudes: an r-band magnitude plus smooth colours."""
+    rng = np.random.default_rng(seed)
+    r = rng.uniform(18.0, 24.0, rows)
+    g_r = rng.normal(0.8, 0.4, rows)
+    r_i = rng.normal(0.4, 0.25, rows)
+    i_z = rng.normal(0.2, 0.15, rows)
+    z_y = rng.normal(0.1, 0.1, rows)
+    i = r - r_i
+    z = i - i_z
+    return np.stack([r + g_r, r, i, z, z - z_y], axis=1).astype(np.float32)
+
+
+def load_reference(path):
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32)
+    return np.loadtxt(path, delimiter=",", dtype=np.float32, comments="#")
+
+
+def predict(session, batch, chunk_size=1024):
+    batch = normalize(batch)
+    return np.concatenate([
+        session.run(["output"], {"input": batch[start:start + chunk_size]})[0]
+        for start in range(0, len(batch), chunk_size)
+    ])[:, 0]
+
+
+def time_session(session, batch, batch_size, repeats):
+    """Median wall time per row for ``batch_size``-row calls."""
+    rows = batch[:batch_size]
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(session, rows, chunk_size=batch_size)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) / len(rows)
+
+
+def compare(reference, repeats=20):
+    sessions = {"fp32": build_session(FP32_MODEL_PATH), "int8": build_session(INT8_MODEL_PATH)}
+    for session in sessions.values():
+        warm_up(session)
+    predictions = {name: predict(session, reference) for name, session in sessions.items()}
+    error = predictions["int8"] - predictions["fp32"]
+    report = {
+        "reference_rows": int(len(reference)),
+        "model_bytes": {"fp32": os.path.getsize(FP32_MODEL_PATH), "int8": os.path.getsize(INT8_MODEL_PATH)},
+        "accuracy": {
+            "mean_abs_diff": float(np.mean(np.abs(error))),
+            "max_abs_diff": float(np.max(np.abs(error))),
+            "rms_diff": float(np.sqrt(np.mean(error ** 2))),
+            # Photo-z convention: scatter of dz / (1 + z) relative to the FP32 prediction
+            "sigma_dz_1pz": float(np.std(error / (1 + predictions["fp32"]))),
+        },
+        "latency_us_per_row": {},
+    }
+    for batch_size in (1, 64, 1024):
+        report["latency_us_per_row"][str(batch_size)] = {
+            name: time_session(session, reference, batch_size, repeats) * 1e6
+            for name, session in sessions.items()
+        }
+    return report
+
+
+def markdown(report):
+    lines = [
+        "# INT8 vs FP32 main_network",
+        "",
+        f"Reference rows: {report['reference_rows']}",
+        "",
+        "| metric | value |",
+        "| --- | --- |",
+    ]
+    for name, size in report["model_bytes"].items():
+        lines.append(f"| {name} model bytes | {size} |")
+    for name, value in report["accuracy"].items():
+        lines.append(f"| {name} | {value:.6f} |")
+    lines += ["", "| batch size | fp32 us/row | int8 us/row | speed-up |", "| --- | --- | --- | --- |"]
+    for batch_size, timing in report["latency_us_per_row"].items():
+        lines.append(
+            f"| {batch_size} | {timing['fp32']:.2f} | {timing['int8']:.2f} | {timing['fp32'] / timing['int8']:.2f}x |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reference", help="(N, 5) magnitudes as .npy or .csv")
+    parser.add_argument("--report", default="reports/quantization.md")
+    parser.add_argument("--skip-quantize", action="store_true", help="reuse an existing INT8 model")
+    args = parser.parse_args()
+
+    if not args.skip_quantize:
+        quantize(FP32_MODEL_PATH, INT8_MODEL_PATH)
+    reference = load_reference(args.reference) if args.reference else synthetic_reference()
+    report = compare(reference)
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w") as f:
+        f.write(markdown(report))
+    with open(os.path.splitext(args.report)[0] + ".json", "w") as f:
+        json.dump(report, f, indent=2)
+    print(markdown(report))
+
+
+if __name__ == "__main__":
+    main()
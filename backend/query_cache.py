@@ -0,0 +1,69 @@
+import hashlib
+import threading
+
+import diskcache
+
+from hsc_jobs import normalize_sql
+
+# Part of every key; bumped when normalize_sql changes, so no entry filed under an older normalization is served
+KEY_VERSION = 2
+
+
+class QueryCache:
+    """Persistent cache of parsed HSC query results, keyed by normalized SQL.
+
+    PDR3 is a frozen release, so a finished query's result never changes and
+    can be served again without a job round trip. Entries live in a
+    ``diskcache`` store under ``directory``; once the store exceeds
+    ``size_limit`` bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, size_limit, release_version):
+        self.release_version = release_version
+        self._store = diskcache.Cache(directory, size_limit=size_limit, eviction_policy='least-recently-used')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def key(self, sql):
+        """Digest of ``sql`` with whitespace and (outside quotes) case normalized, scoped to the data release."""
+        return hashlib.blake2b(f'{self.release_version}:{KEY_VERSION}:{normalize_sql(sql)}'.encode(), digest_size=16).hexdigest()
+
+    def get(self, sql):
+        result = self._store.get(self.key(sql))
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def set(self, sql, result):
+        """Store a parsed ``(payload, status)`` result if it is a real answer rather than a parse failure."""
+        payload, status_code = result
+        # An empty cone is a valid answer; a missing header or malformed CSV is not worth remembering
+        if status_code != 200 or payload.get('warning') not in (None, 'No data rows found'):
+            return
+        self._store.set(self.key(sql), result)
+        with self._lock:
+            self.writes += 1
+
+    def clear(self):
+        self._store.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            counts = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'writes': self.writes,
+            }
+        return {
+            **counts,
+            'entries': len(self._store),
+            'bytes': self._store.volume(),
+            'size_limit': self._store.size_limit,
+        }
@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+
+JSON = "application/json"
+OCTET_STREAM = "application/octet-stream"  # raw little-endian float32, C order
+NPY = "application/x-npy"
+BINARY_TYPES = (OCTET_STREAM, NPY)
+
+
+def media_type(header):
+    """Strip parameters such as charset from a Content-Type/Accept value."""
+    return (header or "").split(";")[0].split(",")[0].strip().lower()
+
+
+def decode_tensor(body, content_type, features=None):
+    """View a binary request body as a float32 array without copying it.
+
+    Raw octet-stream bodies are reshaped to (-1, features) when ``features``
+    is given; ``.npy`` bodies keep the shape stored in their header.
+    """
+    if content_type == NPY:
+        return decode_npy(body)
+    if len(body) % 4:
+        raise ValueError(f"octet-stream body of {len(body)} bytes is not a whole number of float32 values")
+    array = np.frombuffer(body, dtype="<f4")
+    if features:
+        if array.size % features:
+            raise ValueError(f"{array.size} values cannot be split into rows of {features} features")
+        array = array.reshape(-1, features)
+    return array
+
+
+def decode_npy(body):
+    """Parse the .npy header and view the payload that follows it in place."""
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.hasobject:
+        raise ValueError("object arrays are not accepted")
+    count = int(np.prod(shape))
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=stream.tell())
+    array = array.reshape(shape, order="F" if fortran_order else "C")
+    # Only copies when the client sent something other than float32
+    return array.astype(np.float32, copy=False)
+
+
+def encode_tensor(array, content_type):
+    """Serialize an output array as raw float32 bytes or a .npy file."""
+    array = np.ascontiguousarray(array, dtype="<f4")
+    if content_type == NPY:
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, array, allow_pickle=False)
+        return buffer.getvalue()
+    return array.tobytes()
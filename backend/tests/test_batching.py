@@ -0,0 +1,81 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batching import MicroBatcher
+
+
+def row_sums(batches):
+    """run_fn recording each batch's size and answering every row with its sum."""
+    def run_fn(batch):
+        batches.append(len(batch))
+        return batch.sum(axis=1, keepdims=True)
+    return run_fn
+
+
+def submit_all(batcher, rows):
+    with ThreadPoolExecutor(max_workers=len(rows)) as executor:
+        futures = [executor.submit(batcher.submit, row) for row in rows]
+        return [future.exception(timeout=10) or future.result() for future in futures]
+
+
+def test_concurrent_rows_are_grouped_up_to_max_batch_size():
+    batches = []
+    batcher = MicroBatcher(row_sums(batches), max_batch_size=4, max_wait=0.5)
+    rows = [np.full(5, i, dtype=np.float32) for i in range(9)]
+    outputs = submit_all(batcher, rows)
+
+    assert batches == [4, 4, 1]
+    # Every caller gets the output of its own row
+    for row, output in zip(rows, outputs):
+        np.testing.assert_array_equal(output, [[row.sum()]])
+    stats = batcher.stats()
+    assert stats['rows'] == 9
+    assert stats['max_batch_size'] == 4
+
+
+def test_lone_row_waits_at_most_max_wait():
+    batches = []
+    batcher = MicroBatcher(row_sums(batches), max_batch_size=64, max_wait=0.05)
+    start = time.perf_counter()
+    output = batcher.submit(np.ones(5, dtype=np.float32))
+    elapsed = time.perf_counter() - start
+
+    np.testing.assert_array_equal(output, [[5.0]])
+    assert batches == [1]
+    assert 0.04 <= elapsed < 1.0
+
+
+def test_run_fn_error_reaches_every_waiter_in_the_group():
+    calls = []
+    lock = threading.Lock()
+
+    def run_fn(batch):
+        with lock:
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise RuntimeError('session failed')
+        return batch.sum(axis=1, keepdims=True)
+
+    batcher = MicroBatcher(run_fn, max_batch_size=8, max_wait=0.5)
+    errors = submit_all(batcher, [np.full(5, i, dtype=np.float32) for i in range(5)])
+
+    assert calls == [5]
+    for error in errors:
+        assert isinstance(error, RuntimeError)
+        assert str(error) == 'session failed'
+    # The batcher keeps serving after a failed group
+    np.testing.assert_array_equal(batcher.submit(np.ones(5, dtype=np.float32)), [[5.0]])
+
+
+def test_rows_of_different_widths_run_separately():
+    batches = []
+    batcher = MicroBatcher(row_sums(batches), max_batch_size=8, max_wait=0.5)
+    rows = [np.ones(5, dtype=np.float32)] * 3 + [np.ones(4, dtype=np.float32)] * 2
+    outputs = submit_all(batcher, rows)
+
+    assert sorted(batches) == [2, 3]
+    assert [float(output[0, 0]) for output in outputs] == [5.0] * 3 + [4.0] * 2
+
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bulk_job import FEATURE_COLUMNS, BulkJobManager, iter_chunks
+
+ROWS = 30
+
+
+@pytest.fixture
+def input_csv(tmp_path):
+    """HSC-style CSV: metainfo comments, a commented header, and comment and blank lines between rows."""
+    lines = ['# Query: SELECT ...', '# Rows: 30', '# object_id,' + ','.join(FEATURE_COLUMNS)]
+    for i in range(ROWS):
+        if i % 7 == 3:
+            lines.append('# page break')
+        if i % 5 == 1:
+            lines.append('')
+        lines.append(','.join([str(1000 + i)] + [f'{20 + i * 0.01 + band:.2f}' for band in range(5)]))
+    path = tmp_path / 'input.csv'
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def wait_for(manager, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        state = manager.status(job_id)
+        if state['status'] in ('done', 'error'):
+            return state
+        assert time.monotonic() < deadline, f'job still {state["status"]}'
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('skip_rows', [0, 1, 4, 11, 29, 30])
+def test_iter_chunks_skips_parsed_rows(input_csv, skip_rows):
+    columns = ['object_id'] + FEATURE_COLUMNS
+    chunks = [chunk for chunk, _ in iter_chunks(input_csv, columns, 4, skip_rows)]
+    ids = pd.concat(chunks)['object_id'].tolist() if chunks else []
+    assert ids == list(range(1000 + skip_rows, 1000 + ROWS))
+
+
+def test_resume_after_interruption_writes_every_row_once(input_csv, tmp_path):
+    calls = []
+
+    def predict(batch, model):
+        calls.append(len(batch))
+        if len(calls) == 3:
+            raise RuntimeError('interrupted')
+        return batch[:, :1] - 20.0
+
+    manager = BulkJobManager(str(tmp_path / 'jobs'), predict)
+    job_id = manager.submit(input_csv, chunk_rows=4)['id']
+    state = wait_for(manager, job_id)
+    assert state['status'] == 'error'
+    assert state['rows_done'] == 8
+
+    manager.resume(job_id)
+    state = wait_for(manager, job_id)
+    assert state['status'] == 'done'
+    assert state['rows_done'] == ROWS
+
+    output = pd.read_csv(state['output_path'])
+    assert output['object_id'].tolist() == list(range(1000, 1000 + ROWS))
+    np.testing.assert_allclose(output['redshift'], np.arange(ROWS) * 0.01, atol=1e-6)
+
+
+@pytest.fixture
+def input_parquet(tmp_path):
+    table = pd.DataFrame({'object_id': np.arange(1000, 1000 + ROWS)})
+    for band, column in enumerate(FEATURE_COLUMNS):
+        table[column] = 20 + np.arange(ROWS) * 0.01 + band
+    path = tmp_path / 'input.parquet'
+    table.to_parquet(path, row_group_size=7)
+    return str(path)
+
+
+@pytest.mark.parametrize('skip_rows', [0, 5, 7, 30])
+def test_iter_chunks_reads_parquet(input_parquet, skip_rows):
+    columns = ['object_id'] + FEATURE_COLUMNS
+    chunks = list(iter_chunks(input_parquet, columns, 4, skip_rows))
+    ids = pd.concat([chunk for chunk, _ in chunks])['object_id'].tolist() if chunks else []
+    assert ids == list(range(1000 + skip_rows, 1000 + ROWS))
+    if chunks:
+        assert chunks[-1][1] == 1.0
+
+
+def test_parquet_job_scores_every_row(input_parquet, tmp_path):
+    manager = BulkJobManager(str(tmp_path / 'jobs'), lambda batch, model: batch[:, :1] - 20.0)
+    state = wait_for(manager, manager.submit(input_parquet, chunk_rows=8)['id'])
+    assert state['status'] == 'done'
+
+    output = pd.read_csv(state['output_path'])
+    assert output['object_id'].tolist() == list(range(1000, 1000 + ROWS))
+    np.testing.assert_allclose(output['redshift'], np.arange(ROWS) * 0.01, atol=1e-5)
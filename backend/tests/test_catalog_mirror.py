@@ -0,0 +1,42 @@
+import numpy as np
+
+from catalog_mirror import CatalogMirror
+
+RA, DEC, RADIUS = 150.0, 2.0, 0.01
+
+
+def fill_csv(rows, seed=0):
+    """An HSC-style fill download of ``rows`` objects scattered over the fill cone."""
+    rng = np.random.default_rng(seed)
+    ras = RA + rng.uniform(-0.03, 0.03, rows)
+    decs = DEC + rng.uniform(-0.03, 0.03, rows)
+    lines = ['# Query: SELECT ...', '# object_id,ra,dec,r_cmodel_mag']
+    lines += [f'{1000 + i},{ra:.7f},{dec:.7f},{20 + i % 4}' for i, (ra, dec) in enumerate(zip(ras, decs))]
+    return '\n'.join(lines) + '\n'
+
+
+def test_fill_sql_is_capped(tmp_path):
+    mirror = CatalogMirror(str(tmp_path), nside=1024, fill_max_rows=500)
+    assert 'LIMIT 501' in mirror.fill_sql(RA, DEC, RADIUS)
+
+
+def test_complete_fill_is_stored(tmp_path):
+    mirror = CatalogMirror(str(tmp_path), nside=1024, fill_max_rows=500)
+    galaxies = mirror.write_back(RA, DEC, RADIUS, fill_csv(300))
+
+    assert galaxies
+    assert mirror.cone_search(RA, DEC, RADIUS) == galaxies
+    assert mirror.stats()['truncated_fills'] == 0
+
+
+def test_truncated_fill_answers_without_storing(tmp_path):
+    mirror = CatalogMirror(str(tmp_path), nside=1024, fill_max_rows=500)
+    galaxies = mirror.write_back(RA, DEC, RADIUS, fill_csv(501))
+
+    assert galaxies
+    assert all(galaxy['magnitude'] < mirror.mag_limit for galaxy in galaxies)
+    # Nothing was stored, so the next search for the cone goes back to HSC
+    assert mirror.cone_search(RA, DEC, RADIUS) is None
+    stats = mirror.stats()
+    assert stats['pixels'] == 0
+    assert stats['truncated_fills'] == 1
@@ -0,0 +1,95 @@
+import re
+
+from hsc_client import HSCHTTPError
+from hsc_coalescer import LookupCoalescer
+from hsc_jobs import HSCJobManager
+
+CREDENTIAL = {'account_name': 'user', 'password': 'secret'}
+
+
+def batch_sql(keys):
+    return f"SELECT object_id, mag FROM forced WHERE object_id IN ({', '.join(keys)})"
+
+
+def single_sql(key):
+    return f"SELECT object_id, mag FROM forced WHERE object_id = {key}"
+
+
+def split(result_csv, keys):
+    rows = dict(line.split(',') for line in result_csv.splitlines())
+    return {key: ({'object_id': key, 'mag': rows.get(key)}, 200) for key in keys}
+
+
+def make_coalescer(status_fn=None, submit_error=None):
+    submitted = []
+
+    def submit_fn(credential, sql, out_format):
+        if submit_error:
+            raise submit_error
+        submitted.append(sql)
+        return {'id': len(submitted)}
+
+    def download_fn(credential, hsc_job_id):
+        # Every key of the IN-list comes back with a magnitude derived from it
+        keys = re.search(r'IN \(([^)]*)\)', submitted[hsc_job_id - 1]).group(1).split(', ')
+        return '\n'.join(f'{key},{int(key) % 100}' for key in keys)
+
+    manager = HSCJobManager(
+        submit_fn, status_fn or (lambda credential, hsc_job_id: {'status': 'done'}), download_fn,
+        first_interval=0.01, max_interval=0.02, status_rate=1000,
+    )
+    coalescer = LookupCoalescer(manager, batch_sql, single_sql, split, kind='details', window=0.2)
+    return coalescer, manager, submitted
+
+
+def finished(manager, job, timeout=10):
+    manager.wait(job, timeout)
+    assert job.status != 'running', 'lookup is still waiting for its batch'
+    return job
+
+
+def test_concurrent_lookups_share_one_batch():
+    coalescer, manager, submitted = make_coalescer()
+    keys = [str(1000 + i) for i in range(8)]
+    jobs = [coalescer.lookup(CREDENTIAL, key) for key in keys]
+
+    assert len({job.id for job in jobs}) == len(keys)
+    for key, job in zip(keys, jobs):
+        assert finished(manager, job).status == 'done'
+        # Each caller sees its own row only
+        assert job.result == ({'object_id': key, 'mag': str(int(key) % 100)}, 200)
+    assert len(submitted) == 1
+    assert all(key in submitted[0] for key in keys)
+    assert coalescer.stats()['batches'] == 1
+
+
+def test_repeated_key_is_queried_once():
+    coalescer, manager, submitted = make_coalescer()
+    jobs = [coalescer.lookup(CREDENTIAL, key) for key in ['1001', '1002', '1001']]
+
+    for job in jobs:
+        finished(manager, job)
+    assert jobs[0].result == jobs[2].result
+    assert submitted[0].count('1001') == 1
+
+
+def test_failed_batch_fails_every_waiter():
+    def status_fn(credential, hsc_job_id):
+        raise HSCHTTPError(404, 'no such job')
+
+    coalescer, manager, _ = make_coalescer(status_fn)
+    jobs = [coalescer.lookup(CREDENTIAL, str(1000 + i)) for i in range(5)]
+
+    for job in jobs:
+        assert finished(manager, job).status == 'error'
+        assert 'no such job' in job.error
+
+
+def test_rejected_batch_submit_fails_every_waiter():
+    coalescer, manager, submitted = make_coalescer(submit_error=HSCHTTPError(400, 'bad query'))
+    jobs = [coalescer.lookup(CREDENTIAL, str(1000 + i)) for i in range(5)]
+
+    for job in jobs:
+        assert finished(manager, job).status == 'error'
+        assert 'bad query' in job.error
+    assert submitted == []
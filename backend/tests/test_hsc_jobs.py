@@ -0,0 +1,145 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hsc_client import HSCHTTPError
+from hsc_jobs import HSCJobManager, normalize_sql
+
+SQL = 'SELECT object_id FROM pdr3_wide.forced LIMIT 1'
+
+
+def make_manager(status_fn, max_poll_failures=3, submit_gate=None):
+    submitted = []
+
+    def submit_fn(credential, sql, out_format):
+        submitted.append(sql)
+        if submit_gate:
+            # Hold the submit call open so concurrent callers arrive while the job is in flight
+            submit_gate.wait(10)
+        return {'id': len(submitted)}
+
+    manager = HSCJobManager(
+        submit_fn, status_fn, lambda credential, hsc_job_id: 'csv',
+        first_interval=0.01, max_interval=0.02, status_rate=1000, max_poll_failures=max_poll_failures,
+    )
+    return manager, submitted
+
+
+def parse(result_csv):
+    return {'rows': result_csv}, 200
+
+
+def finished(manager, job, timeout=10):
+    manager.wait(job, timeout)
+    assert job.status != 'running', 'job is still being polled'
+    return job
+
+
+def test_job_fails_after_repeated_status_errors():
+    calls = []
+
+    def status_fn(credential, hsc_job_id):
+        calls.append(hsc_job_id)
+        raise ConnectionError('connection reset')
+
+    manager, _ = make_manager(status_fn, max_poll_failures=3)
+    job = finished(manager, manager.submit(None, SQL, parse))
+    assert job.status == 'error'
+    assert 'connection reset' in job.error
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('error', [HSCHTTPError(404, 'no such job'), ValueError('Expecting value')])
+def test_permanent_status_error_fails_job_at_once(error):
+    def status_fn(credential, hsc_job_id):
+        raise error
+
+    manager, _ = make_manager(status_fn, max_poll_failures=10)
+    job = finished(manager, manager.submit(None, SQL, parse))
+    assert job.status == 'error'
+    assert job.polls == 1
+
+
+def test_unparseable_status_reply_fails_job():
+    manager, _ = make_manager(lambda credential, hsc_job_id: '<html>maintenance</html>')
+    job = finished(manager, manager.submit(None, SQL, parse))
+    assert job.status == 'error'
+    assert job.polls == 1
+
+
+def test_transient_status_error_is_retried():
+    # Two failures in a row, a good reply that resets the count, then two more
+    replies = iter([
+        HSCHTTPError(429, 'slow down'), ConnectionError('reset'), {'status': 'running'},
+        HSCHTTPError(503, 'unavailable'), ConnectionError('reset'), {'status': 'done'},
+    ])
+
+    def status_fn(credential, hsc_job_id):
+        reply = next(replies)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    manager, _ = make_manager(status_fn, max_poll_failures=3)
+    job = finished(manager, manager.submit(None, SQL, parse))
+    assert job.status == 'done'
+    assert job.result == ({'rows': 'csv'}, 200)
+
+
+def test_failed_job_releases_single_flight_slot():
+    def status_fn(credential, hsc_job_id):
+        raise HSCHTTPError(404, 'no such job')
+
+    manager, submitted = make_manager(status_fn)
+    first = finished(manager, manager.submit(None, SQL, parse))
+    second = manager.submit(None, SQL, parse)
+    assert second is not first
+    assert len(submitted) == 2
+
+
+def test_normalize_sql_keeps_quoted_literals():
+    assert normalize_sql('SELECT  *\n FROM t') == normalize_sql('select * from t')
+    assert normalize_sql("SELECT * FROM t WHERE name = 'ABC'") != normalize_sql("SELECT * FROM t WHERE name = 'abc'")
+    assert normalize_sql("SELECT * FROM t WHERE name = 'a  b'") != normalize_sql("SELECT * FROM t WHERE name = 'a b'")
+
+
+def submit_concurrently(manager, sqls, gate):
+    """Submit every query from its own thread, letting the held submit call return once all the rest have attached."""
+    def release():
+        deadline = time.monotonic() + 10
+        while manager.deduplicated < len(sqls) - 1 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        gate.set()
+
+    threading.Thread(target=release, daemon=True).start()
+    with ThreadPoolExecutor(max_workers=len(sqls)) as executor:
+        return list(executor.map(lambda sql: manager.submit(None, sql, parse), sqls))
+
+
+def test_concurrent_identical_submits_share_one_job():
+    gate = threading.Event()
+    manager, submitted = make_manager(lambda credential, hsc_job_id: {'status': 'done'}, submit_gate=gate)
+    sqls = [SQL, SQL.lower(), f'  {SQL}\n', SQL.replace(' ', '\n  ')] * 2
+    jobs = submit_concurrently(manager, sqls, gate)
+
+    assert len(submitted) == 1
+    assert len({job.id for job in jobs}) == 1
+    assert manager.deduplicated == len(sqls) - 1
+    assert finished(manager, jobs[0]).result == ({'rows': 'csv'}, 200)
+
+
+def test_failed_shared_job_reaches_every_waiter():
+    gate = threading.Event()
+
+    def status_fn(credential, hsc_job_id):
+        raise HSCHTTPError(404, 'no such job')
+
+    manager, submitted = make_manager(status_fn, submit_gate=gate)
+    jobs = submit_concurrently(manager, [SQL] * 6, gate)
+
+    assert len(submitted) == 1
+    for job in jobs:
+        assert finished(manager, job).status == 'error'
+        assert 'no such job' in job.error
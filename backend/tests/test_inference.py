@@ -0,0 +1,65 @@
+import importlib
+import os
+
+import numpy as np
+import pytest
+
+from conftest import BACKEND_DIR
+
+# ONNX Runtime's CPU GEMM picks its kernel by row count (small batches take a different path than
+# large ones), which changes the float32 accumulation order. Batched and single-row outputs can
+# therefore differ in the last bits: at most 2 ulp through this network, i.e. ~2e-7 at z ~ 1,
+# five orders of magnitude below the photo-z scatter. Anything beyond 4 ulp is a real mismatch.
+MAX_ULP = 4
+
+
+@pytest.fixture(scope='module')
+def inference(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv('INFERENCE_MODEL_PATH', os.path.join(BACKEND_DIR, 'main_network.onnx'))
+        env.setenv('INFERENCE_INT8_MODEL_PATH', os.path.join(BACKEND_DIR, 'main_network.int8.onnx'))
+        env.setenv('INFERENCE_MODEL_CACHE_DIR', '')
+        env.setenv('INFERENCE_JOBS_DIR', str(tmp_path_factory.mktemp('jobs')))
+        env.setenv('INFERENCE_CACHE_SIZE', '0')
+        env.setenv('INFERENCE_WORKERS', '0')
+        env.setenv('INFERENCE_MICROBATCH', '0')
+        # model_session may already be imported by other test modules, so its cache setting is read already
+        env.setattr(importlib.import_module('model_session'), 'MODEL_CACHE_DIR', '')
+        yield importlib.import_module('inference')
+
+
+def magnitudes(rows):
+    return np.random.default_rng(0).normal(22.0, 1.5, (rows, 5)).astype(np.float32)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1024])
+def test_run_batch_matches_single_rows(inference, chunk_size):
+    batch = magnitudes(257)
+    batched = inference.run_batch(batch, chunk_size=chunk_size)
+    single = np.concatenate([inference.run_batch(batch[i:i + 1]) for i in range(len(batch))])
+    assert batched.shape == single.shape == (len(batch), 1)
+    np.testing.assert_array_max_ulp(batched, single, maxulp=MAX_ULP)
+
+
+def test_run_batch_single_row_chunks_are_exact(inference):
+    batch = magnitudes(33)
+    single = np.concatenate([inference.run_batch(batch[i:i + 1]) for i in range(len(batch))])
+    np.testing.assert_array_equal(inference.run_batch(batch, chunk_size=1), single)
+
+
+@pytest.mark.parametrize('data, single_row', [
+    ([[20.0] * 5, [20.0] * 4], False),  # ragged
+    ([[20.0] * 4, [21.0] * 4], False),  # wrong width
+    ([20.0] * 5, False),  # not a matrix
+    ([20.0] * 6, True),
+    ([20.0, 'x', 21.0, 22.0, 23.0], True),
+])
+def test_malformed_rows_are_rejected(inference, data, single_row):
+    with pytest.raises(inference.HTTPException) as error:
+        inference.input_matrix(data, inference.DEFAULT_MODEL, single_row=single_row)
+    assert error.value.status_code == 400
+
+
+def test_input_matrix_accepts_model_width(inference):
+    assert inference.input_matrix([20.0] * 5, inference.DEFAULT_MODEL, single_row=True).shape == (1, 5)
+    assert inference.input_matrix([[20.0] * 5] * 3, inference.DEFAULT_MODEL).shape == (3, 5)
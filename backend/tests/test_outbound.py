@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from hsc_client import HSCClient
+from outbound import OutboundGovernor
+
+
+def test_interactive_callers_are_admitted_before_background():
+    governor = OutboundGovernor({'das': (1, 0)})
+    admitted = []
+    blocker_in = threading.Event()
+    release_blocker = threading.Event()
+
+    def blocker():
+        with governor.slot('das'):
+            blocker_in.set()
+            release_blocker.wait(10)
+
+    def call(name, cls):
+        with governor.slot('das', cls):
+            admitted.append(name)
+
+    with ThreadPoolExecutor(max_workers=7) as executor:
+        executor.submit(blocker)
+        assert blocker_in.wait(10)
+        # Background callers queue first, then interactive ones arrive behind them
+        futures = [executor.submit(call, f'background-{i}', 'background') for i in range(3)]
+        wait_queued(governor, 3)
+        futures += [executor.submit(call, f'interactive-{i}', 'interactive') for i in range(3)]
+        wait_queued(governor, 6)
+        release_blocker.set()
+        for future in futures:
+            future.result(timeout=10)
+
+    assert admitted == [f'interactive-{i}' for i in range(3)] + [f'background-{i}' for i in range(3)]
+    classes = governor.stats()['das']['classes']
+    assert classes['interactive']['admitted'] == 4
+    assert classes['background']['admitted'] == 3
+
+
+def wait_queued(governor, count, endpoint='das'):
+    deadline = time.monotonic() + 10
+    while governor.stats()[endpoint]['queued'] < count:
+        assert time.monotonic() < deadline, 'callers never queued'
+        time.sleep(0.005)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b'# object_id\n' + b''.join(b'%d\n' % i for i in range(1000))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_streamed_download_holds_its_slot_until_closed(server):
+    governor = OutboundGovernor({'hsc_api': (1, 0)})
+    client = HSCClient(base_url=server, governor=governor)
+
+    stream = client.post('download', {}, stream=True)
+    assert stream.readline() == b'# object_id\n'
+    assert governor.stats()['hsc_api']['in_flight'] == 1
+
+    # A second call on the lane waits for the download to finish
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        waiting = executor.submit(client.post, 'status', {})
+        wait_queued(governor, 1, 'hsc_api')
+        assert not waiting.done()
+        assert len(stream.read().splitlines()) == 1000
+        stream.close()
+        waiting.result(timeout=10).close()
+
+    assert governor.stats()['hsc_api']['in_flight'] == 0
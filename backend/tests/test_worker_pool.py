@@ -0,0 +1,47 @@
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from conftest import BACKEND_DIR
+from model_session import model_hash
+from worker_pool import WorkerPool
+
+MODEL_PATH = os.path.join(BACKEND_DIR, 'main_network.onnx')
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Workers are spawned processes; they inherit the environment, not monkeypatched module globals
+    monkeypatch.setenv('INFERENCE_MODEL_CACHE_DIR', '')
+    pool = WorkerPool({'fp32': MODEL_PATH}, {'fp32': model_hash(MODEL_PATH)}, features=5, workers=2, slots=2, slot_rows=8)
+    yield pool
+    pool.close()
+
+
+def run(pool, batch, timeout=30):
+    """pool.run on another thread, so a hang fails the test instead of blocking it."""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(pool.run, batch, 'fp32', model_hash(MODEL_PATH)).result(timeout=timeout)
+
+
+def test_dead_worker_is_restarted(pool):
+    batch = np.random.default_rng(0).normal(22.0, 1.5, (40, 5)).astype(np.float32)
+    expected = run(pool, batch)
+
+    os.kill(pool._workers[0].process.pid, signal.SIGKILL)
+    # Work sent while the worker is dead either lands on the live worker or fails fast, but never hangs
+    try:
+        run(pool, batch)
+    except RuntimeError:
+        pass
+
+    deadline = time.monotonic() + 30
+    while pool.stats()[0]['restarts'] < 1 or not pool.stats()[0]['alive']:
+        assert time.monotonic() < deadline, 'worker was not restarted'
+        time.sleep(0.1)
+    np.testing.assert_array_equal(run(pool, batch), expected)
+    assert all(worker.free_slots.qsize() == 2 for worker in pool._workers)
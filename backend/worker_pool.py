@@ -0,0 +1,244 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from model_session import build_session, normalize, warm_up
+
+
+def _views(buffer, slots, slot_rows, features):
+    """Input and output ring slots laid out back to back in one shared buffer."""
+    inputs = np.ndarray((slots, slot_rows, features), dtype=np.float32, buffer=buffer)
+    outputs = np.ndarray((slots, slot_rows, 1), dtype=np.float32, buffer=buffer, offset=inputs.nbytes)
+    return inputs, outputs
+
+
+def _worker_main(shm_name, slots, slot_rows, features, cores, model_paths, model_hashes, requests, responses):
+    """Worker process: own session per model variant, pinned to ``cores``."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    threads = max(len(cores), 1)
+    shm = SharedMemory(name=shm_name)
+    inputs, outputs = _views(shm.buf, slots, slot_rows, features)
+    sessions = {}
+    for name, path in model_paths.items():
+        sessions[name] = build_session(path, intra_op_threads=threads, inter_op_threads=1, digest=model_hashes[name])
+        warm_up(sessions[name])
+    responses.put(("ready", None))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        slot, rows, model, digest = message
+        try:
+            if digest != model_hashes[model]:
+                # The parent saw the model file change; pick up the new graph before serving it
+                sessions[model] = build_session(model_paths[model], intra_op_threads=threads, inter_op_threads=1, digest=digest)
+                warm_up(sessions[model])
+                model_hashes[model] = digest
+            batch = normalize(inputs[slot, :rows])
+            outputs[slot, :rows] = sessions[model].run(["output"], {"input": batch})[0]
+            responses.put((slot, None))
+        except Exception as e:
+            responses.put((slot, repr(e)))
+
+    del inputs, outputs
+    shm.close()
+
+
+class _Worker:
+    """One worker process and its slot ring; a worker that dies is started again with the same slots."""
+
+    def __init__(self, ctx, index, cores, slots, slot_rows, features, model_paths, model_hashes):
+        self.ctx = ctx
+        self.index = index
+        self.cores = cores
+        self.slots = slots
+        self.slot_rows = slot_rows
+        self.features = features
+        self.model_paths = model_paths
+        self.model_hashes = model_hashes
+        self.shm = SharedMemory(create=True, size=slots * slot_rows * (features + 1) * 4)
+        self.inputs, self.outputs = _views(self.shm.buf, slots, slot_rows, features)
+        self.free_slots = queue.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+        self.pending = {}
+        self.alive = False
+        self.closing = False
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self.reader = None
+        self._spawn()
+
+    def _spawn(self):
+        # Fresh queues: a process killed mid-put can leave the old ones unusable
+        self.requests = self.ctx.Queue()
+        self.responses = self.ctx.Queue()
+        self.process = self.ctx.Process(
+            target=_worker_main,
+            args=(self.shm.name, self.slots, self.slot_rows, self.features, self.cores, self.model_paths,
+                  self.model_hashes, self.requests, self.responses),
+            name=f"inference-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+
+    def _await_ready(self):
+        while True:
+            try:
+                status, _ = self.responses.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Inference worker {self.index} exited during start-up")
+        if status != "ready":
+            raise RuntimeError(f"Inference worker {self.index} failed to start")
+
+    def wait_ready(self):
+        self._await_ready()
+        self.alive = True
+        self.reader = threading.Thread(target=self._read, name=f"inference-worker-{self.index}-reader", daemon=True)
+        self.reader.start()
+
+    def submit(self, chunk, model, digest):
+        slot = self.free_slots.get()
+        with self._lock:
+            if not self.alive:
+                self.free_slots.put(slot)
+                raise RuntimeError(f"Inference worker {self.index} is not running")
+            rows = len(chunk)
+            self.inputs[slot, :rows] = chunk
+            future = Future()
+            self.pending[slot] = (future, rows)
+            self.requests.put((slot, rows, model, digest))
+            # A restarted process then loads (and warms up) the model the requests are for
+            self.model_hashes[model] = digest
+        return future
+
+    def _read(self):
+        while True:
+            try:
+                slot, error = self.responses.get(timeout=1)
+            except queue.Empty:
+                if self.closing:
+                    return
+                if not self.process.is_alive():
+                    self._restart()
+                    if not self.alive:
+                        return
+                continue
+            if slot is None:
+                return
+            with self._lock:
+                future, rows = self.pending.pop(slot)
+                # Copy the result out before the slot can be reused by the next request
+                result = None if error else self.outputs[slot, :rows].copy()
+            self.free_slots.put(slot)
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def _restart(self):
+        """Fail what the dead process was holding, give its slots back and start a new process."""
+        with self._lock:
+            self.alive = False
+            failed, self.pending = self.pending, {}
+        error = RuntimeError(f"Inference worker {self.index} exited")
+        for slot, (future, _) in failed.items():
+            self.free_slots.put(slot)
+            future.set_exception(error)
+        print(f"WorkerPool: Warning: worker {self.index} exited with code {self.process.exitcode}, restarting, failed={len(failed)}")
+        try:
+            self._spawn()
+            self._await_ready()
+        except Exception as e:
+            print(f"WorkerPool: Error: worker {self.index} could not be restarted: {str(e)}")
+            return
+        with self._lock:
+            self.alive = not self.closing
+            self.restarts += 1
+        print(f"WorkerPool: Action=Restarted worker, index={self.index}, pid={self.process.pid}")
+
+    def close(self):
+        self.closing = True
+        with self._lock:
+            self.alive = False
+        self.requests.put(None)
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.responses.put((None, None))
+        if self.reader:
+            self.reader.join(timeout=5)
+        del self.inputs, self.outputs
+        self.shm.close()
+        self.shm.unlink()
+
+
+class WorkerPool:
+    """N inference processes, each pinned to a slice of cores, fed through shared memory.
+
+    Each worker owns a ring of ``slots`` shared-memory slots of ``slot_rows``
+    rows. A batch is split into slot-sized chunks that are written straight
+    into free slots and spread round-robin over the workers; only the slot
+    index and row count cross the process boundary.
+    """
+
+    def __init__(self, model_paths, model_hashes, features, workers, slots=4, slot_rows=1024):
+        ctx = multiprocessing.get_context("spawn")
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        if workers <= len(cores):
+            core_slices = [list(map(int, s)) for s in np.array_split(cores, workers)]
+        else:
+            # More workers than cores: share cores round-robin rather than leave workers unpinned
+            core_slices = [[cores[index % len(cores)]] for index in range(workers)]
+        self.slot_rows = slot_rows
+        self.features = features
+        self._workers = [
+            _Worker(ctx, index, core_slices[index], slots, slot_rows, features, model_paths, dict(model_hashes))
+            for index in range(workers)
+        ]
+        for worker in self._workers:
+            worker.wait_ready()
+        self._next_worker = itertools.count()
+        print(f"WorkerPool: Action=Started workers, count={workers}, cores={core_slices}")
+
+    def run(self, batch, model, digest):
+        """Normalize and score an (N, F) array across the workers."""
+        if batch.ndim != 2 or batch.shape[1] != self.features:
+            raise ValueError(f"expected rows of {self.features} features, got shape {batch.shape}")
+        futures = []
+        for start in range(0, len(batch), self.slot_rows):
+            # A worker that is being restarted gets no new chunks; with none running, fail rather than wait
+            workers = [worker for worker in self._workers if worker.alive]
+            if not workers:
+                raise RuntimeError("No inference workers are running")
+            worker = workers[next(self._next_worker) % len(workers)]
+            futures.append(worker.submit(batch[start:start + self.slot_rows], model, digest))
+        outputs = [future.result() for future in futures]
+        return np.concatenate(outputs) if outputs else np.empty((0, 1), dtype=np.float32)
+
+    def stats(self):
+        return [
+            {
+                'worker': worker.index,
+                'pid': worker.process.pid,
+                'alive': worker.alive and worker.process.is_alive(),
+                'restarts': worker.restarts,
+                'cores': worker.cores,
+                'busy_slots': len(worker.pending),
+            }
+            for worker in self._workers
+        ]
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()